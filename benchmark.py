@@ -0,0 +1,156 @@
+import os
+import glob
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+from collections import Counter
+
+DEMO_DIR = os.path.join(os.path.dirname(__file__), 'demo')
+
+def box_iou(box, boxes):
+  width = np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0])
+  height = np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1])
+  overlap = np.clip(width, 0, None) * np.clip(height, 0, None)
+  areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+  return overlap / ((box[2] - box[0]) * (box[3] - box[1]) + areas - overlap)
+
+def match_boxes(reference, result, iou=0.5):
+  # Greedily matches boxes of the same class with IoU >= iou, returns the number of matches
+  candidates = [box for box in result.boxes]
+  matches = 0
+  for box in reference.boxes:
+    same_class = [other for other in candidates if other.cls[0] == box.cls[0]]
+    if not same_class:
+      continue
+    overlaps = box_iou(np.array(box.xyxy), np.array([other.xyxy for other in same_class]))
+    best = overlaps.argmax()
+    if overlaps[best] >= iou:
+      candidates.remove(same_class[best])
+      matches += 1
+  return matches
+
+def benchmark_vision(configs, images, repeats=5):
+  # Compares every configuration with the PyTorch model on the same images. Precision and recall
+  # are box matches against the PyTorch detections, tiles is the share of images whose detected
+  # tiles are exactly the same.
+  from vision import Vision
+
+  reference = Vision(backend='torch')
+  references = [reference.predict(image) for image in images]
+
+  rows = []
+  for name, options in configs:
+    vision = Vision(**options).warmup()
+    times = []
+    for _ in range(repeats):
+      for image in images:
+        start = time.perf_counter()
+        vision.predict(image)
+        times.append(time.perf_counter() - start)
+
+    results = [vision.predict(image) for image in images]
+    matches = sum([match_boxes(ref, result) for ref, result in zip(references, results)])
+    detected = sum([len(result.boxes) for result in results])
+    expected = sum([len(ref.boxes) for ref in references])
+    same_tiles = np.mean([Counter(box.cls[1] for box in ref.boxes) == Counter(box.cls[1] for box in result.boxes)
+      for ref, result in zip(references, results)])
+    rows.append((name, np.median(times), np.percentile(times, 90), matches / max(detected, 1), matches / max(expected, 1), same_tiles))
+
+  lines = [f"{'Backend':<18} {'p50 ms':>9} {'p90 ms':>9} {'Precision':>10} {'Recall':>8} {'Tiles':>7}"]
+  for name, p50, p90, precision, recall, tiles in rows:
+    lines.append(f"{name:<18} {p50*1000:9.1f} {p90*1000:9.1f} {precision:10.3f} {recall:8.3f} {tiles:7.2f}")
+  return '\n'.join(lines)
+
+def vision_configs(threads):
+  configs = [('torch', {'backend': 'torch'})]
+  for count in threads:
+    configs.append((f"onnx t={count}", {'backend': 'onnx', 'threads': count}))
+    configs.append((f"onnx-int8 t={count}", {'backend': 'onnx', 'quantize': True, 'threads': count}))
+  return configs
+
+def benchmark_variants(variants, backends=('milp', 'implicit'), games=1, max_turns=100):
+  # Catalogue build time and peak memory, color symmetry setup and solve latency of each backend on
+  # positions recorded from self-play, per variant given as (colors, numbers, copies, jokers, min set length).
+  # The implicit backend is measured on the lazy catalogue it plays with, see Game(lazy_jokers=True).
+  from optimizer import Game, TileColor, SOLVERS
+  from simulator import Simulator
+  from dataset import StateDataset
+
+  rows = []
+  for colors, numbers, copies, jokers, min_length in variants:
+    options = {'deck_tile_colors': list(TileColor)[:colors], 'deck_tile_numbers': [*range(1, numbers + 1)],
+      'deck_copies': copies, 'deck_jokers': jokers, 'min_set_length': min_length, 'cache_dir': None}
+
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'positions.rks')
+      Simulator(players=4, backend='implicit', max_turns=max_turns, record=path,
+        player_initial_tiles=2 * min_length + 7, **options).run(games=games, processes=1)
+      states = list(StateDataset(path, Game(lazy_jokers=True, **options)).states())
+
+    name = f"{colors}x{numbers}x{copies} j={jokers} m={min_length}"
+    for backend in backends:
+      game_options = {**options, 'lazy_jokers': backend == 'implicit'}
+      Game._catalogues.clear()
+      start = time.perf_counter()
+      game = Game(**game_options)
+      build = time.perf_counter() - start
+
+      Game._catalogues.clear()
+      tracemalloc.start()
+      Game(**game_options)
+      memory = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+
+      Game._symmetries.clear()
+      start = time.perf_counter()
+      game.symmetries()
+      symmetries = time.perf_counter() - start
+
+      solver = SOLVERS[backend](game)
+      times = []
+      for rack, board, initial_play in states:
+        if initial_play:
+          board = np.zeros_like(board)
+        start = time.perf_counter()
+        solver.solve(rack, board)
+        times.append(time.perf_counter() - start)
+      rows.append((name, backend, len(game.tile_sets), game.sets_matrix.nnz, build, memory, symmetries, len(states),
+        np.median(times), np.percentile(times, 90)))
+
+  lines = [f"{'Variant':<22} {'Backend':<9} {'Sets':>8} {'Entries':>9} {'Build s':>8} {'Peak MiB':>9} {'Sym s':>7} "
+    f"{'Positions':>9} {'p50 ms':>9} {'p90 ms':>9}"]
+  for name, backend, sets, entries, build, memory, symmetries, positions, p50, p90 in rows:
+    lines.append(f"{name:<22} {backend:<9} {sets:8d} {entries:9d} {build:8.2f} {memory/2**20:9.1f} {symmetries:7.2f} "
+      f"{positions:9d} {p50*1000:9.2f} {p90*1000:9.2f}")
+  return '\n'.join(lines)
+
+def variant(text):
+  # colors:numbers:copies:jokers:min_set_length
+  return tuple(int(value) for value in text.split(':'))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Rummikub benchmarks')
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  vision_parser = commands.add_parser('vision', help='Accuracy vs latency of the tile detector backends on the demo images')
+  vision_parser.add_argument('--images', nargs='*', default=sorted(glob.glob(os.path.join(DEMO_DIR, '*.jpeg'))))
+  vision_parser.add_argument('--repeats', type=int, default=5)
+  vision_parser.add_argument('--threads', type=int, nargs='*', default=[1, os.cpu_count()])
+
+  variants_parser = commands.add_parser('variants', help='Catalogue, memory and solve scaling with the variant size')
+  variants_parser.add_argument('--variants', type=variant, nargs='*',
+    default=[(4, 13, 2, 2, 3), (6, 20, 3, 4, 3), (6, 30, 4, 8, 4), (6, 30, 4, 8, 5), (6, 30, 4, 8, 6)],
+    help='colors:numbers:copies:jokers:min_set_length')
+  variants_parser.add_argument('--backends', nargs='*', default=['milp', 'implicit'])
+  variants_parser.add_argument('--games', type=int, default=1)
+  variants_parser.add_argument('--max-turns', type=int, default=100)
+
+  args = parser.parse_args()
+
+  match args.command:
+    case 'vision':
+      print(benchmark_vision(vision_configs(sorted(set(args.threads))), args.images, args.repeats))
+    case 'variants':
+      print(benchmark_variants(args.variants, args.backends, args.games, args.max_turns))
@@ -0,0 +1,88 @@
+import os
+import json
+import numpy as np
+
+MAGIC = b'RKSTATE1'
+ALIGNMENT = 64
+
+class StateDataset():
+
+  # Append-only file of Game.state_dtype records behind a JSON header. Readers memory-map the
+  # records, so batches are views into the file rather than copies. One writer at a time.
+  #
+  #   MAGIC | header length (uint32) | JSON header, padded to 64 bytes | records
+
+  def __init__(self, path, game=None):
+    self.path = path
+    self._records = None
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+      self.header, self.offset = self.read_header(path)
+      self.dtype = np.lib.format.descr_to_dtype(self.header['descr'])
+      if game is not None and (self.dtype != game.state_dtype() or self.header['catalogue'] != catalogue(game)):
+        raise ValueError(f"{path} was recorded for a different game configuration")
+    elif game is not None:
+      self.dtype = game.state_dtype()
+      self.header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'catalogue': catalogue(game)}
+      self.offset = self.write_header(path, self.header)
+    else:
+      raise FileNotFoundError(f"{path} does not exist, a game is needed to create it")
+
+  @staticmethod
+  def read_header(path):
+    with open(path, 'rb') as f:
+      if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{path} is not a state dataset")
+      length = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+      header = json.loads(f.read(length))
+    return header, len(MAGIC) + 4 + length
+
+  @staticmethod
+  def write_header(path, header):
+    data = json.dumps(header).encode()
+    data += b' ' * (-(len(MAGIC) + 4 + len(data)) % ALIGNMENT)
+    with open(path, 'wb') as f:
+      f.write(MAGIC + np.uint32(len(data)).astype('<u4').tobytes() + data)
+    return len(MAGIC) + 4 + len(data)
+
+  def __len__(self):
+    # A record cut short by a crashed writer is not counted
+    return (os.path.getsize(self.path) - self.offset) // self.dtype.itemsize
+
+  def append(self, records):
+    records = np.asarray(records, dtype=self.dtype).reshape(-1)
+    with open(self.path, 'ab') as f:
+      f.seek(self.offset + len(self) * self.dtype.itemsize)
+      f.truncate()
+      f.write(records.tobytes())
+    return len(records)
+
+  def records(self):
+    # The whole dataset as a read-only memory-mapped array, mapped again when records were appended
+    count = len(self)
+    if self._records is None or len(self._records) != count:
+      if count == 0:
+        self._records = np.zeros(0, dtype=self.dtype)
+      else:
+        self._records = np.memmap(self.path, dtype=self.dtype, mode='r', offset=self.offset, shape=(count,))
+    return self._records
+
+  def __getitem__(self, index):
+    return self.records()[index]
+
+  def batches(self, batch_size=1024, start=0, stop=None):
+    # Yields consecutive slices of the records, batch['rack'] etc. are (batch, tiles) views
+    records = self.records()
+    stop = len(records) if stop is None else min(stop, len(records))
+    for i in range(start, stop, batch_size):
+      yield records[i:min(i + batch_size, stop)]
+
+  def states(self, batch_size=1024, start=0, stop=None):
+    # (rack, board, initial play) states in the form Optimizer.solve_many takes
+    for batch in self.batches(batch_size, start, stop):
+      racks = batch['rack'].astype(float)
+      boards = batch['board'].astype(float)
+      for rack, board, initial_play in zip(racks, boards, batch['initial_play']):
+        yield rack, board, bool(initial_play)
+
+def catalogue(game):
+  return json.loads(json.dumps(game.catalogue_key()))
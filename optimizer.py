@@ -1,9 +1,14 @@
 from enum import Enum
-import random
+import os
+import time
+import hashlib
+import multiprocessing
+import pickle
 import numpy as np
-from itertools import combinations, islice, groupby
-import cvxpy as cp
-from copy import deepcopy
+from itertools import combinations, chain, product, permutations
+from collections import OrderedDict
+from scipy import sparse
+from profiler import PROFILER
 
 class TileType(Enum):
   NUMBER = 1
@@ -14,6 +19,8 @@ class TileColor(Enum):
   BLUE = 2
   ORANGE = 3
   RED = 4
+  GREEN = 5
+  PURPLE = 6
 
 class SetType(Enum):
   RUN = 1
@@ -21,31 +28,74 @@ class SetType(Enum):
 
 class Tile():
 
+  __slots__ = ('type', 'value', 'name', 'code', 'index')
+
+  # Interned tile instances, shared by all games in the process
+  tiles = []
+  tiles_by_code = {}
+  tiles_by_name = {}
+
+  @classmethod
+  def by_index(cls, index):
+    return Tile.tiles[index]
+
+  @classmethod
+  def by_code(cls, code):
+    tile = Tile.tiles_by_code.get(code)
+    if tile is not None:
+      return tile
+    if code // 1000 == TileType.JOKER.value:
+      return JokerTile()
+    else:
+      return NumberTile(TileColor(code // 100 % 10), code % 100)
+
   @classmethod
   def by_name(cls, name):
     tile_name = name.upper()
+    tile = Tile.tiles_by_name.get(tile_name)
+    if tile is not None:
+      return tile
     if tile_name == 'JOKER':
       return JokerTile()
     else:
       color, value = tile_name.split('_', 1)
       return NumberTile(TileColor[color], int(value))
 
+  @classmethod
+  def intern(cls, tile):
+    tile.index = len(Tile.tiles)
+    Tile.tiles.append(tile)
+    Tile.tiles_by_code[tile.code] = tile
+    Tile.tiles_by_name[tile.name] = tile
+    return tile
+
   def __eq__(self, other):
     if isinstance(other, self.__class__):
       return self.code==other.code
     return NotImplemented
 
   def __hash__(self):
-    return hash(self.code)
+    return self.code
+
+  def __reduce__(self):
+    return (Tile.by_code, (self.code,))
 
 class NumberTile(Tile):
 
-  def __init__(self, color, value):
-    self.type = TileType.NUMBER
-    self.color = color
-    self.value = value
-    self.name = f"{self.color.name}_{self.value}"
-    self.code = int(f'{self.type.value}{self.color.value}{str(self.value).zfill(2)}')
+  __slots__ = ('color',)
+
+  def __new__(cls, color, value):
+    code = TileType.NUMBER.value*1000 + color.value*100 + value
+    tile = Tile.tiles_by_code.get(code)
+    if tile is None:
+      tile = object.__new__(cls)
+      tile.type = TileType.NUMBER
+      tile.color = color
+      tile.value = value
+      tile.name = f"{color.name}_{value}"
+      tile.code = code
+      Tile.intern(tile)
+    return tile
 
   def __str__(self):
     return f"[{self.name}]"
@@ -55,11 +105,19 @@ class NumberTile(Tile):
 
 class JokerTile(Tile):
 
-  def __init__(self):
-    self.type = TileType.JOKER
-    self.value = 30
-    self.name = self.type.name
-    self.code = int(f'{self.type.value}000')
+  __slots__ = ()
+
+  def __new__(cls):
+    code = TileType.JOKER.value*1000
+    tile = Tile.tiles_by_code.get(code)
+    if tile is None:
+      tile = object.__new__(cls)
+      tile.type = TileType.JOKER
+      tile.value = 30
+      tile.name = tile.type.name
+      tile.code = code
+      Tile.intern(tile)
+    return tile
 
   def __str__(self):
     return f"[{self.name}]"
@@ -67,24 +125,114 @@ class JokerTile(Tile):
   def __repr__(self):
     return f"[{self.name}]"
 
+# Catalogues are cached per user, never in the source tree. The format version is part of every
+# file name, so files of an older layout are never read.
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'rummikub')
+CATALOGUE_FORMAT = 1
+
+class SolveCache():
+
+  # Bounded LRU of solutions keyed by Game.canonical_state. Entries are stored in canonical
+  # coordinates as (solved, value, tiles, set indices, set counts).
+
+  def __init__(self, maxsize=10000):
+    self.maxsize = maxsize
+    self.entries = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def get(self, key):
+    entry = self.entries.get(key)
+    if entry is None:
+      self.misses += 1
+      return None
+    self.entries.move_to_end(key)
+    self.hits += 1
+    return entry
+
+  def put(self, key, entry):
+    self.entries[key] = entry
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.maxsize:
+      self.entries.popitem(last=False)
+
+  def clear(self):
+    self.entries.clear()
+    self.hits = 0
+    self.misses = 0
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'hit_rate': self.hits / lookups if lookups else 0,
+      'size': len(self.entries),
+      'maxsize': self.maxsize,
+    }
+
+  def save(self, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+      pickle.dump(list(self.entries.items()), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+  def load(self, path):
+    with open(path, 'rb') as f:
+      for key, entry in pickle.load(f):
+        self.put(key, entry)
+    return self
+
+# Shared by the optimizers that opt in with cache=SOLVE_CACHE, e.g. the server's solver processes
+SOLVE_CACHE = SolveCache()
+
 class Game():
 
+    _catalogues = {}
+    _symmetries = {}
+
     def __init__(self,
       deck_tile_types=[TileType.NUMBER, TileType.JOKER],
       deck_tile_colors=[TileColor.BLUE, TileColor.BLACK, TileColor.ORANGE, TileColor.RED],
       deck_tile_numbers=[*range(1, 14)],
       deck_copies=2,
+      deck_jokers=None,
       player_initial_tiles=13,
       player_min_initial_value=30,
-      min_set_length=3):
+      min_set_length=3,
+      lazy_jokers=False,
+      cache_dir=CACHE_DIR,
+      seed=None):
 
       self.deck_tile_types = deck_tile_types
       self.deck_tile_colors = deck_tile_colors
       self.deck_tile_numbers = deck_tile_numbers
       self.deck_copies = deck_copies
+      self.deck_jokers = deck_jokers
       self.player_initial_tiles = player_initial_tiles
       self.player_min_initial_value = player_min_initial_value
       self.min_set_length = min_set_length
+      self.lazy_jokers = lazy_jokers
+      self.cache_dir = cache_dir
+      self.seed = seed
+      self.rng = np.random.default_rng(seed)
+
+      self.config = {
+        'deck_tile_types': deck_tile_types,
+        'deck_tile_colors': deck_tile_colors,
+        'deck_tile_numbers': deck_tile_numbers,
+        'deck_copies': deck_copies,
+        'deck_jokers': deck_jokers,
+        'player_initial_tiles': player_initial_tiles,
+        'player_min_initial_value': player_min_initial_value,
+        'min_set_length': min_set_length,
+        'lazy_jokers': lazy_jokers,
+        'cache_dir': cache_dir,
+        'seed': seed,
+      }
 
       self.tiles = []
       for copy in range(self.deck_copies):
@@ -94,9 +242,12 @@ class Game():
               for number in self.deck_tile_numbers:
                 tile = NumberTile(color=color, value=number)
                 self.tiles.append(tile)
-          elif tile_type.name == 'JOKER':
+          elif tile_type.name == 'JOKER' and self.deck_jokers is None:
             tile = JokerTile()
             self.tiles.append(tile)
+      # One joker per copy unless the variant says otherwise
+      if TileType.JOKER in self.deck_tile_types and self.deck_jokers is not None:
+        self.tiles += [JokerTile() for _ in range(self.deck_jokers)]
       self.tiles = sorted(self.tiles, key=lambda x: x.code)
 
       self.tile_map = {}
@@ -105,72 +256,295 @@ class Game():
         self.tile_map[tile.code] = tile.name
         self.tile_map_reversed[tile.name] = tile.code
 
-      tile_sets = set()
-      number_tiles = [x for x in self.tiles if x.type == TileType.NUMBER]
-      joker_tiles = [x for x in self.tiles if x.type == TileType.JOKER]
-
-      # Get all possible & desirable runs
-      runs = set()
-      tiles = sorted(set(number_tiles), key=lambda x: x.code)
-      for i in range(0, len(tiles)):
-        for set_length in range(self.min_set_length, self.min_set_length*2):
-          run = sorted(islice(tiles, i, i+set_length, 1), key=lambda x: x.code)
-          if len(run) == set_length:
-            if all(tile.color == run[0].color for tile in run):
-              runs.add(self.Board.Run(tiles=run))
-      tile_sets.update(runs)
-
-      # Get all possible & desirable groups
-      groups = set()
-      tiles = sorted(set(number_tiles), key=lambda x: x.value)
-      grps = groupby(tiles, lambda x: x.value)
-      for _, grp in grps:
-        tiles = list(grp)
-        for set_length in range(self.min_set_length, len(self.deck_tile_colors)+1):
-          combs = combinations(tiles, set_length)
-          for comb in combs:
-            groups.add(self.Board.Group(tiles=list(comb)))
-      tile_sets.update(groups)
-
-      # Get all possible & desirable joker variations
-      joker_sets = set()
-      for tile_set in tile_sets:
-
-        match tile_set.type:
-          case SetType.RUN:
-            if len(tile_set.tiles) > self.min_set_length:
-              replacement_positions = range(1, len(tile_set.tiles)-1)
-            else:
-              replacement_positions = range(len(tile_set.tiles))
-          case SetType.GROUP:
-            if len(tile_set.tiles) > self.min_set_length:
-              replacement_positions = range(0)
-            else:
-              replacement_positions = range(len(tile_set.tiles))
-
-        variations = {tile_set}
-        for joker in joker_tiles:
-          for variation in variations.copy():
-            for replacement_position in replacement_positions:
-              if not variation.tiles[replacement_position] == joker and variation.tiles.count(joker) < len(joker_tiles):
-                variation_tiles = deepcopy(variation.tiles)
-                variation_tiles[replacement_position] = joker
-                match tile_set.type:
-                  case SetType.RUN:
-                    variations.add(self.Board.Run(tiles=variation_tiles))
-                  case SetType.GROUP:
-                    variations.add(self.Board.Group(tiles=variation_tiles))
+      self.tiles_unique = sorted(set(self.tiles), key=lambda x: x.code)
+      self.tile_index = {tile: i for i, tile in enumerate(self.tiles_unique)}
 
-        joker_sets.update(variations)
+      self.tiles_count_array = np.array([self.tiles.count(tile) for tile in self.tiles_unique])
+      self.tiles_code_array = np.array([tile.code for tile in self.tiles_unique])
+      self.tiles_value_array = np.array([tile.value for tile in self.tiles_unique])
 
-      tile_sets.update(joker_sets)
-
-      self.tile_sets = list(tile_sets)
+      # Codes of the joker runs a lazy catalogue added after its listed sets, see set_index
+      self.joker_runs = ()
+      with PROFILER.stage('game.tile_sets') as stage:
+        self.tile_sets = self.load_tile_sets()
+        if self.lazy_jokers:
+          self.tile_sets = list(self.tile_sets)
+        self.tile_set_index = {tile_set: i for i, tile_set in enumerate(self.tile_sets)}
+        stage.set(sets=len(self.tile_sets))
+      with PROFILER.stage('game.sets_matrix'):
+        self.sets_matrix = self.build_sets_matrix()
 
       self.players = []
       self.deck = self.Deck(game=self)
       self.board = self.Board(game=self)
 
+    def catalogue_key(self):
+      colors = tuple(sorted(color.value for color in self.deck_tile_colors))
+      numbers = tuple(sorted(self.deck_tile_numbers))
+      jokers = len([x for x in self.tiles if x.type == TileType.JOKER])
+      return (colors, numbers, self.deck_copies, self.min_set_length, jokers, self.lazy_jokers)
+
+    def sets_key(self):
+      # The catalogue as it is now, which for a lazy catalogue includes the joker runs added so far
+      return self.catalogue_key() + self.joker_runs
+
+    def load_tile_sets(self):
+      key = self.catalogue_key()
+      if key in Game._catalogues:
+        return Game._catalogues[key]
+
+      path = None
+      if self.cache_dir is not None:
+        digest = hashlib.sha1(repr((CATALOGUE_FORMAT, key)).encode()).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f"tile_sets-v{CATALOGUE_FORMAT}-{digest}.npz")
+
+      codes = None
+      if path is not None and os.path.exists(path):
+        try:
+          with PROFILER.stage('game.read_tile_sets'):
+            codes, types = self.read_tile_set_codes(path)
+        except (OSError, ValueError, KeyError):
+          codes = None
+
+      if codes is None:
+        with PROFILER.stage('game.build_tile_sets'):
+          codes, types = self.build_tile_set_codes()
+        if path is not None:
+          try:
+            self.write_tile_set_codes(path, codes, types)
+          except OSError:
+            pass
+
+      tile_sets = self.tile_sets_from_codes(codes, types)
+      Game._catalogues[key] = tile_sets
+      return tile_sets
+
+    def tile_set_blocks(self):
+      # Streams the catalogue as (set type, codes) blocks with one set of equal length per row: the runs
+      # and groups of each length followed by their joker variants
+      if TileType.NUMBER not in self.deck_tile_types:
+        return
+      numbers = np.array(sorted(set(self.deck_tile_numbers)))
+      colors = np.array(sorted(color.value for color in self.deck_tile_colors))
+      jokers = len([x for x in self.tiles if x.type == TileType.JOKER])
+      number_codes = TileType.NUMBER.value*1000 + colors[:, None]*100 + numbers[None, :]
+
+      for length in range(self.min_set_length, min(self.min_set_length*2, len(numbers)+1)):
+        runs = np.lib.stride_tricks.sliding_window_view(number_codes, length, axis=1).reshape(-1, length)
+        yield SetType.RUN, runs
+        if self.lazy_jokers and length > self.min_set_length:
+          continue
+        for variants in self.joker_variants(runs, self.joker_positions(SetType.RUN, length), jokers):
+          yield SetType.RUN, variants
+
+      for length in range(self.min_set_length, len(colors)+1):
+        color_combinations = np.array(list(combinations(range(len(colors)), length)))
+        groups = number_codes[color_combinations].transpose(2, 0, 1).reshape(-1, length)
+        yield SetType.GROUP, groups
+        for variants in self.joker_variants(groups, self.joker_positions(SetType.GROUP, length), jokers):
+          # Groups are ordered by code, which puts the jokers last
+          yield SetType.GROUP, np.sort(variants, axis=1)
+
+    def joker_positions(self, set_type, length):
+      # Jokers can replace any tile of a set of the minimum length and only inner tiles of a longer run,
+      # longer groups take no jokers
+      if length == self.min_set_length:
+        return range(length)
+      return range(1, length-1) if set_type == SetType.RUN else range(0)
+
+    def set_index(self, tile_set):
+      # Catalogue index of a set, or None if it is not in the catalogue. A lazy catalogue leaves out the
+      # joker variants of runs longer than the minimum and adds one the first time it is asked for, in
+      # every color so that the catalogue stays closed under recoloring.
+      index = self.tile_set_index.get(tile_set)
+      if index is None and self.lazy_jokers and self.is_joker_run(tile_set):
+        codes = np.array(tile_set.codes)
+        run_color = Tile.by_code(tile_set.codes[0]).color.value
+        color_lookup = np.arange(10)
+        tile_sets = []
+        for color in sorted(color.value for color in self.deck_tile_colors):
+          color_lookup[run_color] = color
+          recolored = self.Board.Run.from_codes(Game.recolor(codes, color_lookup).tolist())
+          if recolored not in self.tile_set_index:
+            self.tile_set_index[recolored] = len(self.tile_sets) + len(tile_sets)
+            tile_sets.append(recolored)
+        self.tile_sets += tile_sets
+        self.joker_runs += tuple(recolored.codes for recolored in tile_sets)
+        self.sets_matrix = sparse.hstack([self.sets_matrix, self.build_sets_matrix(tile_sets)]).tocsc()
+        index = self.tile_set_index[tile_set]
+      return index
+
+    def is_joker_run(self, tile_set):
+      # Whether a set is one of the joker variants of long runs that a lazy catalogue leaves out
+      codes = tile_set.codes
+      length = len(codes)
+      positions = [i for i, code in enumerate(codes) if code == TileType.JOKER.value*1000]
+      jokers = len([x for x in self.tiles if x.type == TileType.JOKER])
+      if tile_set.type != SetType.RUN or length <= self.min_set_length or not 0 < len(positions) <= jokers:
+        return False
+      if not set(positions) <= set(self.joker_positions(SetType.RUN, length)):
+        return False
+      numbers = sorted(set(self.deck_tile_numbers))
+      first = Tile.by_code(codes[0])
+      start = numbers.index(first.value) if first.value in numbers else len(numbers)
+      if start + length > len(numbers):
+        return False
+      run = [first.code - first.value + number for number in numbers[start:start+length]]
+      return (all(code == run[i] for i, code in enumerate(codes) if i not in positions)
+        and self.Board.Run.from_codes(run) in self.tile_set_index)
+
+    def adopt_sets(self, sets, joker_runs):
+      # Set counts solved on another copy of this game, e.g. in a worker process, as counts over this
+      # catalogue. joker_runs are the codes of the sets the other copy added last, see set_index.
+      base = len(sets) - len(joker_runs)
+      indices = list(range(base)) + [self.set_index(self.Board.Run.from_codes(codes)) for codes in joker_runs]
+      counts = np.zeros(len(self.tile_sets))
+      np.add.at(counts, indices, sets)
+      return counts
+
+    def joker_variants(self, codes, positions, jokers):
+      for count in range(1, min(jokers, len(positions)) + 1):
+        for replaced in combinations(positions, count):
+          variants = codes.copy()
+          variants[:, replaced] = TileType.JOKER.value*1000
+          yield variants
+
+    def build_tile_set_codes(self):
+      # Zero padded codes and types of the distinct sets, ordered by (type, codes) for a stable set
+      # order across processes
+      blocks = list(self.tile_set_blocks())
+      max_length = max([codes.shape[1] for _, codes in blocks], default=0)
+      rows = np.zeros((sum([len(codes) for _, codes in blocks]), max_length + 1), dtype=np.int16)
+      offset = 0
+      for set_type, codes in blocks:
+        rows[offset:offset+len(codes), 0] = set_type.value
+        rows[offset:offset+len(codes), 1:codes.shape[1]+1] = codes
+        offset += len(codes)
+      rows = np.unique(rows, axis=0) if len(rows) else rows
+      return rows[:, 1:], rows[:, 0].astype(np.uint8)
+
+    def tile_sets_from_codes(self, codes, types):
+      lookup = np.full(max(TileType.JOKER.value*1000, int(codes.max(initial=0))) + 1, -1, dtype=np.int64)
+      for code in np.unique(codes[codes != 0]).tolist():
+        lookup[code] = Tile.by_code(code).index
+      indices = lookup[codes].tolist()
+      lengths = np.count_nonzero(codes, axis=1).tolist()
+      set_classes = {SetType.RUN.value: self.Board.Run, SetType.GROUP.value: self.Board.Group}
+      return [set_classes[set_type].from_indices(row[:length]) for set_type, row, length in zip(types.tolist(), indices, lengths)]
+
+    def symmetries(self):
+      # Tile and set index maps for every permutation of the colors, under which the catalogue is closed.
+      # The set maps are built per permutation on first use, see SetMaps.
+      key = self.sets_key()
+      if key not in Game._symmetries:
+        colors = sorted(color.value for color in self.deck_tile_colors)
+        color_lookups = np.tile(np.arange(10), (len(list(permutations(colors))), 1))
+        color_lookups[:, colors] = list(permutations(colors))
+
+        mapped = np.array([Game.recolor(self.tiles_code_array, color_lookup) for color_lookup in color_lookups])
+        tile_maps = np.searchsorted(self.tiles_code_array, mapped).reshape(len(color_lookups), -1)
+        codes, types = self.tile_set_codes()
+        Game._symmetries[key] = (tile_maps, np.argsort(tile_maps, axis=1),
+          self.SetMaps(codes, types, color_lookups), self.SetMaps(codes, types, color_lookups, inverse=True))
+      return Game._symmetries[key]
+
+    @staticmethod
+    def recolor(codes, color_lookup):
+      # Tile codes with every color c replaced by color_lookup[c], jokers and padding stay
+      colors = codes // 100 % 10
+      numbers = codes // 1000 == TileType.NUMBER.value
+      return np.where(numbers, codes + (color_lookup[colors] - colors) * 100, codes).astype(codes.dtype)
+
+    def canonical_state(self, rack_array, board_array, initial_play):
+      # Smallest recolored (rack, board) over all color permutations, so color-symmetric positions share one key
+      tile_maps, tile_inverses, _, _ = self.symmetries()
+      state = np.concatenate([rack_array, board_array]).astype(np.uint8)
+      recolored = np.concatenate([state[:len(rack_array)][tile_inverses], state[len(rack_array):][tile_inverses]], axis=1)
+      candidates = [row.tobytes() for row in recolored]
+      permutation = min(range(len(candidates)), key=candidates.__getitem__)
+      key = (self.sets_key(), self.player_min_initial_value, bool(initial_play), candidates[permutation])
+      return key, permutation
+
+    def build_sets_matrix(self, tile_sets=None):
+      # Tiles x sets incidence matrix, built from the tile indices of every set
+      tile_sets = self.tile_sets if tile_sets is None else tile_sets
+      rows = np.full(len(Tile.tiles), -1, dtype=np.int64)
+      rows[[tile.index for tile in self.tiles_unique]] = np.arange(len(self.tiles_unique))
+      set_lengths = np.fromiter((len(tile_set.indices) for tile_set in tile_sets), dtype=np.int64, count=len(tile_sets))
+      indices = np.fromiter(chain.from_iterable(tile_set.indices for tile_set in tile_sets), dtype=np.int64, count=set_lengths.sum())
+      columns = np.repeat(np.arange(len(tile_sets)), set_lengths)
+      data = np.ones(len(indices), dtype=np.int64)
+      sets_matrix = sparse.coo_matrix((data, (rows[indices], columns)), shape=(len(self.tiles_unique), len(tile_sets)))
+      return sets_matrix.tocsc()
+
+    def read_tile_set_codes(self, path):
+      with np.load(path) as data:
+        return data['codes'], data['types']
+
+    def tile_set_codes(self, tile_sets=None):
+      # Tile codes of every set padded with zeros, and the set types
+      tile_sets = self.tile_sets if tile_sets is None else tile_sets
+      max_length = max([len(tile_set.indices) for tile_set in tile_sets], default=0)
+      codes = np.zeros((len(tile_sets), max_length), dtype=np.int16)
+      for i, tile_set in enumerate(tile_sets):
+        codes[i, :len(tile_set.indices)] = tile_set.codes
+      types = np.array([tile_set.type.value for tile_set in tile_sets], dtype=np.uint8)
+      return codes, types
+
+    def write_tile_set_codes(self, path, codes, types):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      tmp_path = f"{path}.{os.getpid()}.tmp"
+      with open(tmp_path, 'wb') as f:
+        np.savez(f, codes=codes, types=types)
+      os.replace(tmp_path, path)
+
+    def state_dtype(self):
+      # One fixed size record per position: tile counts of the rack, board and deck, the board sets as
+      # catalogue indices (one entry per copy, padded with the largest index value) and the initial play flag.
+      # Joker runs a lazy catalogue added are numbered in the order they were added, so boards holding
+      # them only load back into the game that recorded them.
+      tiles = len(self.tiles_unique)
+      set_index = np.uint16 if len(self.tile_sets) < np.iinfo(np.uint16).max else np.uint32
+      return np.dtype([('rack', np.uint8, tiles), ('board', np.uint8, tiles), ('deck', np.uint8, tiles),
+        ('sets', set_index, len(self.tiles) // self.min_set_length), ('initial_play', np.uint8)])
+
+    def encode_state(self, player):
+      # The position as seen by player, record.tobytes() is the binary form
+      record = np.zeros((), dtype=self.state_dtype())
+      indices = [self.set_index(tile_set) for tile_set in self.board.tile_sets]
+      if None in indices:
+        raise ValueError('The board holds a set that is not in the catalogue')
+      record['rack'] = player.rack.counts
+      record['board'] = self.board.counts
+      record['deck'] = self.deck.counts
+      record['sets'] = np.iinfo(record['sets'].dtype).max
+      record['sets'][:len(indices)] = indices
+      record['initial_play'] = player.initial_play
+      return record
+
+    def decode_state(self, record):
+      # Returns (rack, board, deck, board set counts, initial play) for a record or its bytes
+      if isinstance(record, (bytes, bytearray, memoryview)):
+        record = np.frombuffer(record, dtype=self.state_dtype())[0]
+      sets = record['sets']
+      board_sets = np.bincount(sets[sets < len(self.tile_sets)], minlength=len(self.tile_sets)).astype(float)
+      return (record['rack'].astype(float), record['board'].astype(float), record['deck'].astype(float),
+        board_sets, bool(record['initial_play']))
+
+    def load_state(self, record, player):
+      # Restores the board, the deck (in a new shuffled order) and the rack of player from a record
+      rack, board, deck, board_sets, initial_play = self.decode_state(record)
+      self.board.replace_tile_sets([self.tile_sets[i] for i in np.flatnonzero(board_sets) for _ in range(int(board_sets[i]))])
+      tiles = [tile for tile, count in zip(self.tiles_unique, deck) for _ in range(int(count))]
+      self.deck.tiles = [tiles[i] for i in self.rng.permutation(len(tiles))]
+      self.deck.counts[:] = deck
+      player.rack.clear()
+      for tile, count in zip(self.tiles_unique, rack):
+        for _ in range(int(count)):
+          player.rack.add_tile(tile)
+      player.initial_play = initial_play
+      return player
+
     def __str__(self):
       players = '\n\n'.join([str(player) for player in self.players])
       return f"Rummikub Game\n{self.deck}\n{self.board}\n\n{players}"
@@ -181,22 +555,80 @@ class Game():
       self.players.append(player)
       return player
 
+    class SetMaps():
+
+      # Set index map of each color permutation (or its inverse), indexed like the tile maps. There are
+      # n_colors! permutations and every map is as long as the catalogue, so maps are built on first use
+      # and the least recently used ones are dropped.
+
+      def __init__(self, codes, types, color_lookups, inverse=False, maxsize=256):
+        self.codes = codes
+        self.types = types
+        self.groups = types == SetType.GROUP.value
+        self.color_lookups = color_lookups
+        self.inverse = inverse
+        self.maxsize = maxsize
+        self.maps = OrderedDict()
+        keys = self.keys(types, codes)
+        self.order = np.argsort(keys)
+        self.sorted_keys = keys[self.order]
+
+      def __len__(self):
+        return len(self.color_lookups)
+
+      def __getitem__(self, permutation):
+        set_map = self.maps.get(permutation)
+        if set_map is None:
+          set_map = self.maps[permutation] = self.build(permutation)
+          if len(self.maps) > self.maxsize:
+            self.maps.popitem(last=False)
+        else:
+          self.maps.move_to_end(permutation)
+        return set_map
+
+      def build(self, permutation):
+        # Runs keep their order when recolored, groups are sorted by code again
+        mapped = Game.recolor(self.codes, self.color_lookups[permutation])
+        padding = np.iinfo(mapped.dtype).max
+        mapped[self.groups] = np.sort(np.where(mapped[self.groups] == 0, padding, mapped[self.groups]), axis=1)
+        mapped[mapped == padding] = 0
+        set_map = self.order[np.searchsorted(self.sorted_keys, self.keys(self.types, mapped))]
+        return np.argsort(set_map) if self.inverse else set_map
+
+      @staticmethod
+      def keys(types, codes):
+        # One byte string per set whose byte order is the (type, codes) order
+        rows = np.ascontiguousarray(np.column_stack([types, codes]).astype('>u2'))
+        return rows.view(np.dtype((np.void, rows.shape[1] * rows.itemsize))).ravel()
+
     class Deck():
 
       def __init__(self, game):
         self.game = game
-        self.tiles = self.game.tiles.copy()
+        # Shuffled once with the game's generator, tiles are drawn from the end
+        self.tiles = [self.game.tiles[i] for i in self.game.rng.permutation(len(self.game.tiles))]
+        self.counts = self.game.tiles_count_array.copy()
 
       def __str__(self):
         tiles = ', '.join([str(tile) for tile in self.tiles])
         return f"Deck ({len(self.tiles)}): [{tiles}]"
 
       def add_tile(self, tile):
-        self.tiles.append(tile)
+        self.tiles.insert(self.game.rng.integers(len(self.tiles)+1), tile)
+        self.counts[self.game.tile_index[tile]] += 1
         return tile
 
+      def draw(self, count=1):
+        count = min(max(count, 0), len(self.tiles))
+        tiles = self.tiles[len(self.tiles)-count:]
+        del self.tiles[len(self.tiles)-count:]
+        for tile in tiles:
+          self.counts[self.game.tile_index[tile]] -= 1
+        return tiles
+
       def remove_tile(self, tile):
         self.tiles.remove(tile)
+        self.counts[self.game.tile_index[tile]] -= 1
 
       def search_tile(self, name):
         for tile in self.tiles:
@@ -210,6 +642,7 @@ class Game():
           self.game = game
           self.tile_sets = []
           self.tiles = []
+          self.counts = np.zeros(len(self.game.tiles_unique), dtype=np.int64)
 
       def __str__(self):
           tile_sets = '\n'.join([str(tile_set) for tile_set in self.tile_sets])
@@ -217,14 +650,38 @@ class Game():
 
       def add_tile_set(self, tile_set):
           self.tile_sets.append(tile_set)
-          self.update_tiles()
+          for tile in tile_set.tiles:
+            self.tiles.append(tile)
+            self.counts[self.game.tile_index[tile]] += 1
           return tile_set
 
-      def update_tiles(self):
+      def replace_tile_sets(self, tile_sets, counts=None):
+          # Counts can be passed when they are already known, e.g. board + played tiles
+          self.tile_sets = tile_sets
+          self.update_tiles(counts)
+
+      def clear(self):
+          self.tile_sets = []
           self.tiles = []
-          for tile_set in self.tile_sets:
-            for tile in tile_set.tiles:
-              self.tiles.append(tile)
+          self.counts[:] = 0
+
+      def update_tiles(self, counts=None):
+          self.tiles = [tile for tile_set in self.tile_sets for tile in tile_set.tiles]
+          if counts is None:
+            self.counts[:] = 0
+            for tile in self.tiles:
+              self.counts[self.game.tile_index[tile]] += 1
+          else:
+            self.counts[:] = counts
+
+      def set_counts(self):
+          # Board sets counted over Game.tile_sets, or None if a set is not in the catalogue
+          indices = [self.game.set_index(tile_set) for tile_set in self.tile_sets]
+          if None in indices:
+            return None
+          counts = np.zeros(len(self.game.tile_sets))
+          np.add.at(counts, indices, 1)
+          return counts
 
       def search_tile_set(self, name):
           for tile_set in self.tile_sets:
@@ -234,6 +691,10 @@ class Game():
 
       class TileSet():
 
+        __slots__ = ('indices', '_hash')
+
+        type = None
+
         @classmethod
         def by_names(cls, names):
             tiles = [Tile.by_name(name) for name in names]
@@ -245,35 +706,67 @@ class Game():
             else:
               return Game.Board.TileSet(tiles)
 
+        @classmethod
+        def from_indices(cls, indices):
+            # Trusts the tile order, used for catalogue sets that are already normalized
+            tile_set = cls.__new__(cls)
+            tile_set.indices = tuple(indices)
+            tile_set._hash = hash((cls.type, tile_set.indices))
+            return tile_set
+
+        @classmethod
+        def from_codes(cls, codes):
+            return cls.from_indices([Tile.by_code(code).index for code in codes])
+
+        def __init__(self, tiles=[]):
+            self.indices = tuple(tile.index for tile in tiles)
+            self._hash = hash((self.type, self.indices))
+
+        @property
+        def tiles(self):
+            return tuple(Tile.tiles[i] for i in self.indices)
+
+        @property
+        def codes(self):
+            return tuple(Tile.tiles[i].code for i in self.indices)
+
         def __str__(self):
             tile_string = ', '.join([str(tile) for tile in self.tiles])
             return f"{self.type.name}[{tile_string}]"
 
         def __eq__(self, other):
           if isinstance(other, self.__class__):
-            return self.tiles==other.tiles
+            return self.indices==other.indices
           return NotImplemented
 
         def __hash__(self):
-          tile_string = ', '.join([str(tile) for tile in self.tiles])
-          return hash(f"{self.type.name}[{tile_string}]")
+          return self._hash
+
+        def __reduce__(self):
+          return (self.__class__.from_codes, (self.codes,))
 
       class Run(TileSet):
 
-          def __init__(self, tiles=[]):
-              self.type = SetType.RUN
+          __slots__ = ()
+
+          type = SetType.RUN
 
-              jokers = [(i, tile) for i, tile in enumerate(tiles) if tile.type == TileType.JOKER]
+          def __init__(self, tiles=[]):
               sorted_tiles = sorted([tile for tile in tiles if tile.type == TileType.NUMBER], key=lambda x: x.value)
-              for joker in jokers:
-                sorted_tiles.insert(joker[0], joker[1])
-              self.tiles = sorted_tiles
+              if len(sorted_tiles) < len(tiles):
+                for i, tile in enumerate(tiles):
+                  if tile.type == TileType.JOKER:
+                    sorted_tiles.insert(i, tile)
+              super().__init__(sorted_tiles)
 
       class Group(TileSet):
 
+          __slots__ = ()
+
+          type = SetType.GROUP
+
           def __init__(self, tiles=[]):
-              self.type = SetType.GROUP
-              self.tiles = sorted(tiles, key=lambda x: x.code)
+              super().__init__(sorted(tiles, key=lambda x: x.code))
 
     class Player():
 
@@ -289,45 +782,64 @@ class Game():
           return f"{self.name}\n{self.rack}\nScore: {str(self.score)}"
 
       def draw_tile(self, count=1, verbose=True):
-        tiles = []
-        for _ in range(count):
-          if len(self.game.deck.tiles) == 0:
-            print('WARNING: No more tiles in the deck!')
-            return
-          tile = random.choice(self.game.deck.tiles)
-          tiles.append(tile)
-          self.game.deck.remove_tile(tile)
+        tiles = self.game.deck.draw(count)
+        for tile in tiles:
           self.rack.add_tile(tile)
         if verbose:
+          if len(tiles) < count:
+            print('WARNING: No more tiles in the deck!')
           print(f"Tiles drawn:\n[{', '.join([str(tile) for tile in tiles])}]")
         return tiles
 
       def initial_draw(self):
         self.draw_tile(count=self.game.player_initial_tiles, verbose=False)
 
+      def play(self, tiles, sets):
+        # Applies a solution: the sets are the whole new board, or only the new sets on the initial play
+        tile_sets = [self.game.tile_sets[i] for i, s in enumerate(sets) for _ in range(int(s))]
+        board = self.game.board
+        if self.initial_play:
+          for tile_set in tile_sets:
+            board.add_tile_set(tile_set)
+          self.initial_play = False
+        else:
+          board.replace_tile_sets(tile_sets, counts=board.counts + tiles)
+        for i, t in enumerate(tiles):
+          for _ in range(int(t)):
+            self.rack.remove_tile(self.game.tiles_unique[i])
+
       def update_score(self):
-        self.score = 0
-        for tile in self.rack.tiles:
-          self.score += tile.value
+        self.score = self.rack.score
 
       class Rack():
 
         def __init__(self, player):
             self.player = player
             self.tiles = []
+            self.counts = np.zeros(len(self.player.game.tiles_unique), dtype=np.int64)
+            self.score = 0
 
         def __str__(self):
-            tiles = ', '.join([str(tile) for tile in self.tiles])
+            tiles = ', '.join([str(tile) for tile in sorted(self.tiles, key=lambda x: x.code)])
             return f"Rack ({len(self.tiles)} Tiles):\n[{tiles}]"
 
         def add_tile(self, tile):
           self.tiles.append(tile)
-          self.tiles = sorted(self.tiles, key=lambda x: x.code)
+          self.counts[self.player.game.tile_index[tile]] += 1
+          self.score += tile.value
           self.player.update_score()
           return tile
 
         def remove_tile(self, tile):
           self.tiles.remove(tile)
+          self.counts[self.player.game.tile_index[tile]] -= 1
+          self.score -= tile.value
+          self.player.update_score()
+
+        def clear(self):
+          self.tiles = []
+          self.counts[:] = 0
+          self.score = 0
           self.player.update_score()
 
         def search_tile(self, name):
@@ -338,71 +850,157 @@ class Game():
 
       class Optimizer():
 
-          def __init__(self, player):
+          def __init__(self, player, backend='milp', cache=None, **backend_options):
 
               self.player = player
+              self.cache = cache
 
-              self.tiles = sorted(self.player.game.tiles, key=lambda x: x.code)
-              self.tiles_unique = sorted(set(self.tiles), key=lambda x: x.code)
+              game = self.player.game
+              self.tiles = game.tiles
+              self.tiles_unique = game.tiles_unique
 
-              self.tiles_count_array = np.array([self.tiles.count(tile) for tile in self.tiles_unique])
-              self.tiles_code_array = np.array([tile.code for tile in self.tiles_unique])
-              self.tiles_value_array = np.array([tile.value for tile in self.tiles_unique])
+              self.tiles_count_array = game.tiles_count_array
+              self.tiles_code_array = game.tiles_code_array
+              self.tiles_value_array = game.tiles_value_array
 
-              self.sets = self.player.game.tile_sets
-              self.sets_matrix = np.array([np.array([tile_set.tiles.count(tile) for tile_set in self.sets]) for tile in self.tiles_unique])
+              self.sets = game.tile_sets
+              self.sets_matrix = game.sets_matrix
 
-              self.update()
+              with PROFILER.stage('optimizer.init', backend=backend):
+                self.use_backend(backend, **backend_options)
+                self.update()
 
           def update(self):
 
-              self.board = sorted(self.player.game.board.tiles, key=lambda x: x.code)
-              self.board_array = np.array([self.board.count(tile) for tile in self.tiles_unique])
+              with PROFILER.stage('optimizer.update'):
+                self.board_array = self.player.game.board.counts
+                self.rack_array = self.player.rack.counts
 
-              self.rack = sorted(self.player.rack.tiles, key=lambda x: x.code)
-              self.rack_array = np.array([self.rack.count(tile) for tile in self.tiles_unique])
+          def use_backend(self, backend='milp', **backend_options):
+              self.backend_spec = (backend, backend_options)
+              if isinstance(backend, str):
+                backend = SOLVERS[backend](self.player.game, **backend_options)
+              self.backend = backend
+              return backend
 
-          def solve(self):
+          def solve(self, time_limit=None, mip_gap=None):
 
-            self.update()
-
-            sets_matrix = self.sets_matrix
-            if self.player.initial_play:
-                board_array = np.zeros(self.board_array.shape)
-            else:
-                board_array = self.board_array
-            rack_array = self.rack_array
-
-            value = self.tiles_value_array
-
-            deck_copies = self.player.game.deck_copies
-
-            set_variable = cp.Variable(len(self.sets), integer=True)
-            tile_variable = cp.Variable(len(self.tiles_unique), integer=True)
-
-            obj = cp.Maximize(cp.sum(value @ tile_variable))
+            with PROFILER.stage('optimizer.solve') as stage:
+              self.update()
 
-            constraints = [
-                sets_matrix @ set_variable == board_array + tile_variable,
-                tile_variable <= rack_array,
-                set_variable >= 0, set_variable <= deck_copies,
-                tile_variable >= 0, tile_variable <= deck_copies
-            ]
+              board_sets = None if self.player.initial_play else self.player.game.board.set_counts()
+              solution = self.solve_state(self.rack_array, self.board_array, self.player.initial_play,
+                time_limit, mip_gap, board_sets)
+              stage.set(source=self.source, value=float(solution[1]))
+              return solution
+
+          def solve_state(self, rack_array, board_array, initial_play=False, time_limit=None, mip_gap=None, board_sets=None):
+            # self.source records how the answer was found: 'optimal', 'feasible' (best move found
+            # before the time limit or within the gap), 'greedy' (fallback) or 'cache'
+
+            if initial_play:
+                board_array = np.zeros(len(self.tiles_unique))
+                board_sets = np.zeros(len(self.sets))
+
+            if self.cache is None:
+              return self.solve_backend(rack_array, board_array, initial_play, time_limit, mip_gap, board_sets)
+
+            game = self.player.game
+            tile_maps, tile_inverses, set_maps, set_inverses = game.symmetries()
+            key, permutation = game.canonical_state(rack_array, board_array, initial_play)
+
+            entry = self.cache.get(key)
+            if entry is None:
+              solved, value, tiles, sets = self.solve_backend(rack_array, board_array, initial_play, time_limit, mip_gap, board_sets)
+              if self.source != 'optimal':
+                return solved, value, tiles, sets
+              if key[0] != game.sets_key():
+                # The move added joker runs to a lazy catalogue, it is stored for the catalogue as it is now
+                tile_maps, tile_inverses, set_maps, set_inverses = game.symmetries()
+                key, permutation = game.canonical_state(rack_array, board_array, initial_play)
+              canonical_sets = sets[set_inverses[permutation]]
+              set_indices = np.flatnonzero(canonical_sets)
+              entry = (solved, value, tiles[tile_inverses[permutation]].astype(np.int8),
+                set_indices.astype(np.int32), canonical_sets[set_indices].astype(np.uint8))
+              self.cache.put(key, entry)
+              return solved, value, tiles, sets
+
+            self.source = 'cache'
+            solved, value, canonical_tiles, set_indices, set_counts = entry
+            canonical_sets = np.zeros(len(self.sets))
+            canonical_sets[set_indices] = set_counts
+            return solved, value, canonical_tiles[tile_maps[permutation]].astype(float), canonical_sets[set_maps[permutation]]
+
+          def solve_backend(self, rack_array, board_array, initial_play=False, time_limit=None, mip_gap=None, board_sets=None):
+
+            try:
+              solution = self.backend.solve(rack_array, board_array, time_limit, mip_gap)
+              self.source = 'optimal' if solution is None or solution[3] else 'feasible'
+            except TimeoutError:
+              solution = self.backend.greedy(rack_array, board_array, board_sets)
+              self.source = 'greedy'
+
+            if solution is None or not solution[0]:
+              return False, 0, np.zeros(len(self.tiles_unique)), np.zeros(len(self.sets))
 
-            problem = cp.Problem(obj, constraints)
-            problem.solve(solver=cp.GLPK_MI)
+            value, tiles, sets = solution[:3]
 
-            if len(list(problem.solution.primal_vars.keys())) == 0 or problem.value == 0:
-              return False, 0, np.zeros(len(self.tiles_unique)), np.zeros(len(self.sets))
-            elif self.player.initial_play and problem.value < self.player.game.player_min_initial_value:
-              return False, problem.value, problem.solution.primal_vars[list(problem.solution.primal_vars.keys())[0]], \
-                problem.solution.primal_vars[list(problem.solution.primal_vars.keys())[1]]
+            if initial_play and value < self.player.game.player_min_initial_value:
+              return False, value, tiles, sets
             else:
-              return True, problem.value, problem.solution.primal_vars[list(problem.solution.primal_vars.keys())[0]], \
-                problem.solution.primal_vars[list(problem.solution.primal_vars.keys())[1]]
+              return True, value, tiles, sets
+
+          def solve_many(self, states, processes=None, chunksize=16):
+            # Solves (rack counts, board counts, initial play) states and yields the results in order.
+            # Workers build their own Game from the same configuration, which loads the cached catalogue.
+            if processes == 1:
+              for rack_array, board_array, initial_play in states:
+                yield self.solve_state(rack_array, board_array, initial_play)
+              return
+
+            backend, backend_options = self.backend_spec
+            initargs = (self.player.game.config, backend, backend_options, self.cache is not None)
+            with multiprocessing.Pool(processes, initializer=_init_pool, initargs=initargs) as pool:
+              for solved, value, tiles, sets, joker_runs in pool.imap(_solve_state, states, chunksize):
+                yield solved, value, tiles, self.player.game.adopt_sets(sets, joker_runs)
+
+          def solve_top_k(self, k, rearrange_weight=0.0):
+            # Returns up to k distinct moves as (value, tiles, sets, rearranged), where rearranged is the
+            # number of board sets that do not stay as they are. Moves of equal value come with the fewest
+            # rearranged sets first. With a positive rearrange weight every kept board set is worth that many
+            # points, so easier moves can rank above the strict optimum.
+            self.update()
+            game = self.player.game
 
-          def print_solution(self):
-            solved, value, tiles, sets = self.solve()
+            if self.player.initial_play:
+              board_array = np.zeros(len(self.tiles_unique))
+              board_sets = np.zeros(len(self.sets))
+              board_set_count = 0
+              min_value = max(game.player_min_initial_value, 1)
+            else:
+              board_array = self.board_array
+              board_sets = game.board.set_counts()
+              if board_sets is None:
+                board_sets = np.zeros(len(self.sets))
+              board_set_count = len(game.board.tile_sets)
+              min_value = 1
+
+            # Tile values are whole points, so a tie-break worth less than one point over all board sets
+            # never changes the value order
+            tie_break = 1 / (board_set_count + 2)
+            moves = self.backend.solve_top_k(self.rack_array, board_array, board_sets, k, rearrange_weight + tie_break, min_value)
+            return [(value, tiles, sets, board_set_count - np.minimum(sets, board_sets).sum())
+              for value, tiles, sets in moves]
+
+          def print_solution(self, time_limit=None, mip_gap=None):
+            solved, value, tiles, sets = self.solve(time_limit, mip_gap)
+            match self.source:
+              case 'feasible':
+                print("Best move found in time (not proven optimal):")
+              case 'greedy':
+                print("No move found in time, falling back to rack-only sets:")
+              case 'cache':
+                print("Cached solution:")
             if solved:
                 tile_list = [self.tiles_unique[i] for i, t in enumerate(tiles) for _ in range(int(t))]
                 set_list = [self.sets[i] for i, s in enumerate(sets) for _ in range(int(s))]
@@ -414,3 +1012,962 @@ class Game():
                 print(f"No solution found for initial move: value {value}")
             else:
                 print("No solution found.")
+
+_pool_optimizer = None
+
+def _init_pool(config, backend, backend_options, cache=False):
+  global _pool_optimizer
+  game = Game(**config)
+  _pool_optimizer = Game.Player(game).optimizer
+  _pool_optimizer.use_backend(backend, **backend_options)
+  if cache:
+    _pool_optimizer.cache = SOLVE_CACHE
+
+def _solve_state(state):
+  # Also returns the joker runs a lazy catalogue added in this worker, see Game.adopt_sets
+  rack_array, board_array, initial_play = state
+  solution = _pool_optimizer.solve_state(np.asarray(rack_array), np.asarray(board_array), initial_play)
+  return *solution, _pool_optimizer.player.game.joker_runs
+
+class Solver():
+
+  def __init__(self, game):
+    self.game = game
+
+    sets_matrix = game.sets_matrix
+    self.set_columns = np.repeat(np.arange(sets_matrix.shape[1]), np.diff(sets_matrix.indptr))
+    self.top_k_solver = None
+
+  def solve(self, rack_array, board_array, time_limit=None, mip_gap=None):
+    # Returns (value, tiles, sets, optimal) of the best move found, or None if the board cannot be
+    # arranged. Raises TimeoutError if the time limit passes before any move is found.
+    raise NotImplementedError
+
+  def solve_top_k(self, rack_array, board_array, board_sets, k, rearrange_weight=0.0, min_value=1):
+    # Returns up to k moves (value, tiles, sets) with distinct sets used, best first. Backends that
+    # cannot enumerate moves hand them to a MILP built on first use.
+    if self.top_k_solver is None:
+      self.top_k_solver = MilpSolver(self.game)
+    return self.top_k_solver.solve_top_k(rack_array, board_array, board_sets, k, rearrange_weight, min_value)
+
+  def greedy(self, rack_array, board_array, board_sets=None):
+    # Fallback move: leaves the board sets as they are and lays down runs and groups made of rack
+    # tiles only, highest value first. board_sets holds the board set counts over Game.tile_sets.
+    # Returns (value, tiles, sets), or None if the board sets are not known.
+    sets_matrix = self.game.sets_matrix
+    if board_sets is None:
+      if board_array.any():
+        return None
+      board_sets = np.zeros(sets_matrix.shape[1])
+
+    _, candidates, _ = self.presolve(rack_array, np.zeros_like(rack_array))
+    values = self.game.tiles_value_array @ sets_matrix[:, candidates]
+    candidates = candidates[np.argsort(-values, kind='stable')]
+
+    remaining = rack_array.astype(float)
+    sets = board_sets.astype(float)
+    for column in candidates:
+      start, end = sets_matrix.indptr[column], sets_matrix.indptr[column+1]
+      rows, counts = sets_matrix.indices[start:end], sets_matrix.data[start:end]
+      while (remaining[rows] >= counts).all():
+        remaining[rows] -= counts
+        sets[column] += 1
+
+    tiles = rack_array - remaining
+    return self.game.tiles_value_array @ tiles, tiles, sets
+
+  def presolve(self, rack_array, board_array):
+    # Drops every set that needs more of some tile than rack + board hold and every tile no
+    # remaining set uses. Returns the remaining tile rows, set columns and set upper bounds,
+    # or None if some board tile can no longer be placed.
+    sets_matrix = self.game.sets_matrix
+    available = rack_array + board_array
+    if len(self.set_columns) != sets_matrix.nnz:
+      # A lazy catalogue added sets since, see Game.set_index
+      self.set_columns = np.repeat(np.arange(sets_matrix.shape[1]), np.diff(sets_matrix.indptr))
+
+    # Most copies of each set that the tile counts allow
+    copies = np.floor(available[sets_matrix.indices] / sets_matrix.data)
+    set_bounds = np.full(sets_matrix.shape[1], self.game.deck_copies, dtype=float)
+    np.minimum.at(set_bounds, self.set_columns, copies)
+
+    sets = np.flatnonzero(set_bounds > 0)
+    used = np.zeros(sets_matrix.shape[0], dtype=bool)
+    used[sets_matrix[:, sets].indices] = True
+    if (board_array[~used] > 0).any():
+      return None
+    tiles = np.flatnonzero(used)
+
+    return tiles, sets, set_bounds[sets]
+
+class MilpSolver(Solver):
+
+  # cvxpy is imported and the full problem compiled only when the presolve is off or top-k moves
+  # are enumerated without it, the reduced problems go straight to GLPK or HiGHS. The reduced
+  # problem changes shape every turn, so the compiled (DPP) problem and its warm start are only
+  # used with presolve=False. GLPK ignores warm starts, only solvers that take one benefit.
+
+  # Solvers the reduced problems can go to, the compiled problem takes any cvxpy solver
+  REDUCED_SOLVERS = ('GLPK_MI', 'HIGHS')
+
+  def __init__(self, game, solver='GLPK_MI', presolve=True):
+    super().__init__(game)
+    if presolve and solver not in self.REDUCED_SOLVERS:
+      raise ValueError(f"Unknown solver {solver!r}, expected one of {', '.join(self.REDUCED_SOLVERS)}")
+    self.solver = solver
+    self.presolve_sets = presolve
+    self.problem = None
+
+  def build_problem(self):
+    import cvxpy as cp
+
+    n_tiles = len(self.game.tiles_unique)
+    n_sets = len(self.game.tile_sets)
+    deck_copies = self.game.deck_copies
+
+    # Only the board and rack counts change between turns, so they are parameters
+    # and cvxpy canonicalizes the problem once (DPP) and reuses it on every solve
+    self.board_parameter = cp.Parameter(n_tiles, nonneg=True)
+    self.rack_parameter = cp.Parameter(n_tiles, nonneg=True)
+
+    self.set_variable = cp.Variable(n_sets, integer=True)
+    self.tile_variable = cp.Variable(n_tiles, integer=True)
+
+    obj = cp.Maximize(self.game.tiles_value_array @ self.tile_variable)
+
+    constraints = [
+        self.game.sets_matrix @ self.set_variable == self.board_parameter + self.tile_variable,
+        self.tile_variable <= self.rack_parameter,
+        self.set_variable >= 0, self.set_variable <= deck_copies,
+        self.tile_variable >= 0, self.tile_variable <= deck_copies
+    ]
+
+    self.problem = cp.Problem(obj, constraints)
+
+  def build_top_k_problem(self, slots):
+    import cvxpy as cp
+
+    n_tiles = len(self.game.tiles_unique)
+    n_sets = len(self.game.tile_sets)
+    deck_copies = self.game.deck_copies
+
+    # Same move as build_problem with the set counts written in unary, x = u_1 + ... + u_copies
+    # with binary u_1 >= u_2 >= ..., so a move is a binary vector and a no-good cut is one row.
+    # Kept sets are board sets that stay as they are and are rewarded by the rearrange weight.
+    # The cut slots are parameters, so enumerating moves never canonicalizes the problem again;
+    # an inactive slot has a zero support and a zero right hand side.
+    self.top_k_slots = slots
+    self.top_k_board_parameter = cp.Parameter(n_tiles, nonneg=True)
+    self.top_k_rack_parameter = cp.Parameter(n_tiles, nonneg=True)
+    self.board_sets_parameter = cp.Parameter(n_sets, nonneg=True)
+    self.rearrange_weight_parameter = cp.Parameter(nonneg=True)
+    self.min_value_parameter = cp.Parameter(nonneg=True)
+    self.cut_parameters = [cp.Parameter(deck_copies * n_sets, nonneg=True) for _ in range(slots)]
+    self.cut_active_parameters = [cp.Parameter(nonneg=True) for _ in range(slots)]
+
+    self.unary_variable = cp.Variable(deck_copies * n_sets, boolean=True)
+    self.top_k_tile_variable = cp.Variable(n_tiles, integer=True)
+    kept_variable = cp.Variable(n_sets, integer=True)
+
+    unary = [self.unary_variable[c * n_sets:(c + 1) * n_sets] for c in range(deck_copies)]
+    set_counts = sum(unary)
+    value = self.game.tiles_value_array @ self.top_k_tile_variable
+    obj = cp.Maximize(value + self.rearrange_weight_parameter * cp.sum(kept_variable))
+
+    constraints = [
+        self.game.sets_matrix @ set_counts == self.top_k_board_parameter + self.top_k_tile_variable,
+        self.top_k_tile_variable <= self.top_k_rack_parameter,
+        self.top_k_tile_variable >= 0, self.top_k_tile_variable <= deck_copies,
+        kept_variable >= 0, kept_variable <= set_counts, kept_variable <= self.board_sets_parameter,
+        value >= self.min_value_parameter
+    ] + [unary[c + 1] <= unary[c] for c in range(deck_copies - 1)]
+    for cut, active in zip(self.cut_parameters, self.cut_active_parameters):
+      # Number of unary counts that differ from the cut
+      constraints.append(cp.sum(self.unary_variable) - 2 * (cut @ self.unary_variable) + cp.sum(cut) >= active)
+
+    self.top_k_problem = cp.Problem(obj, constraints)
+
+  def solve_top_k(self, rack_array, board_array, board_sets, k, rearrange_weight=0.0, min_value=1):
+
+    if self.presolve_sets:
+      return self.solve_top_k_reduced(rack_array, board_array, board_sets, k, rearrange_weight, min_value)
+
+    import cvxpy as cp
+
+    if (getattr(self, 'top_k_slots', 0) < max(k - 1, 1)
+        or self.unary_variable.size != self.game.deck_copies * len(self.game.tile_sets)):
+      with PROFILER.stage('solver.build_problem'):
+        self.build_top_k_problem(max(k - 1, 1))
+
+    self.top_k_board_parameter.value = board_array
+    self.top_k_rack_parameter.value = rack_array
+    self.board_sets_parameter.value = board_sets
+    self.rearrange_weight_parameter.value = rearrange_weight
+    self.min_value_parameter.value = min_value
+    for cut, active in zip(self.cut_parameters, self.cut_active_parameters):
+      cut.value = np.zeros(cut.size)
+      active.value = 0
+
+    moves = []
+    for i in range(k):
+      try:
+        self.top_k_problem.solve(solver=self.solver, warm_start=True)
+      except cp.SolverError:
+        break
+      if self.top_k_problem.status not in cp.settings.SOLUTION_PRESENT:
+        break
+
+      unary = np.rint(self.unary_variable.value)
+      tiles = np.rint(self.top_k_tile_variable.value)
+      sets = unary.reshape(self.game.deck_copies, -1).sum(axis=0)
+      moves.append((self.game.tiles_value_array @ tiles, tiles, sets))
+
+      if i < self.top_k_slots:
+        self.cut_parameters[i].value = unary
+        self.cut_active_parameters[i].value = 1
+
+    return moves
+
+  def solve_top_k_reduced(self, rack_array, board_array, board_sets, k, rearrange_weight=0.0, min_value=1):
+
+    reduced = self.presolve(rack_array, board_array)
+    if reduced is None:
+      return []
+    tiles, sets, set_bounds = reduced
+    if len(sets) == 0:
+      return []
+
+    rack = rack_array[tiles]
+    playable = np.flatnonzero(rack > 0)
+    values = self.game.tiles_value_array[tiles][playable]
+    max_value = values @ rack[playable]
+    if max_value < min_value:
+      return []
+
+    # Set counts are written in unary, x = u_1 + ... + u_copies with binary u_1 >= u_2 >= ..., so a
+    # move is a binary vector and a no-good cut is a single row. Variables are [u, t, z, s]: the unary
+    # set counts, placed rack tiles, kept board sets and the value above min_value. The value bound is
+    # an equality with the slack s since GLPK's presolver aborts on some problems with it as a row.
+    # The rows are built once. Every move found appends its cut row, and the solver then starts
+    # over on the grown problem, since neither GLPK nor HiGHS keeps a model between calls here.
+    copies = self.game.deck_copies
+    kept = np.flatnonzero(board_sets[sets] > 0)
+    n_sets, n_playable, n_kept = len(sets), len(playable), len(kept)
+    n_unary = copies * n_sets
+    n = n_unary + n_playable + n_kept + 1
+
+    set_matrix = self.game.sets_matrix[tiles][:, sets]
+    placed = sparse.csc_matrix((-np.ones(n_playable), (playable, np.arange(n_playable))), shape=(len(tiles), n_playable))
+    value_row = sparse.coo_matrix((np.append(values, -1), (np.zeros(n_playable + 1, dtype=int),
+      np.append(n_unary + np.arange(n_playable), n - 1))), shape=(1, n))
+    equality_matrix = sparse.vstack([
+      sparse.hstack([set_matrix] * copies + [placed, sparse.csc_matrix((len(tiles), n_kept + 1))]), value_row]).tocsr()
+    equality_vector = np.append(board_array[tiles], min_value).astype(float)
+
+    kept_range = np.arange(n_kept)
+    order_rows = np.arange((copies - 1) * n_sets)
+    # u_(c+1) <= u_c and z <= x
+    rows = [
+      sparse.coo_matrix((np.concatenate([np.ones(len(order_rows)), -np.ones(len(order_rows))]),
+        (np.tile(order_rows, 2), np.concatenate([order_rows + n_sets, order_rows]))), shape=(len(order_rows), n)),
+      sparse.coo_matrix((np.concatenate([np.ones(n_kept), -np.ones(n_kept * copies)]),
+        (np.concatenate([kept_range] * (copies + 1)),
+         np.concatenate([n_unary + n_playable + kept_range] + [c * n_sets + kept for c in range(copies)]))), shape=(n_kept, n))
+    ]
+    vector = [np.zeros(len(order_rows) + n_kept)]
+
+    unary_bounds = np.concatenate([(set_bounds > c) for c in range(copies)])
+    upper_bounds = np.concatenate([unary_bounds, rack[playable], board_sets[sets][kept], [max_value - min_value]]).astype(float)
+    cost = np.concatenate([np.zeros(n_unary), -values, np.full(n_kept, -rearrange_weight), [0]]).astype(float)
+
+    moves = []
+    for _ in range(k):
+      inequality_matrix = sparse.vstack(rows).tocsr()
+      inequality_vector = np.concatenate(vector).astype(float)
+      # No relative gap, HiGHS would otherwise stop short of the rearrange tie-break on high values
+      solution, _ = self.solve_milp(cost, equality_matrix, equality_vector, upper_bounds, mip_gap=0,
+        inequality_matrix=inequality_matrix, inequality_vector=inequality_vector)
+      if solution is None:
+        break
+
+      unary = np.rint(solution[:n_unary])
+      tile_solution = np.zeros(len(self.game.tiles_unique))
+      set_solution = np.zeros(len(self.game.tile_sets))
+      tile_solution[tiles[playable]] = np.rint(solution[n_unary:n_unary + n_playable])
+      set_solution[sets] = unary.reshape(copies, n_sets).sum(axis=0)
+      moves.append((self.game.tiles_value_array @ tile_solution, tile_solution, set_solution))
+
+      # At least one unary count has to flip: sum of (1 - u) where u is 1 and of u where it is 0 >= 1
+      rows.append(sparse.coo_matrix((2 * unary - 1, (np.zeros(n_unary, dtype=int), np.arange(n_unary))), shape=(1, n)))
+      vector.append([unary.sum() - 1])
+
+    return moves
+
+  def solver_options(self, time_limit=None, mip_gap=None):
+    # Time limit and relative MIP gap under the option names of each solver
+    options = {}
+    if self.solver == 'GLPK_MI':
+      if time_limit is not None:
+        options['tm_lim'] = max(int(time_limit * 1000), 1)
+      if mip_gap is not None:
+        options['mip_gap'] = mip_gap
+    elif self.solver == 'HIGHS':
+      if time_limit is not None:
+        options['time_limit'] = time_limit
+      if mip_gap is not None:
+        options['mip_rel_gap'] = mip_gap
+    return options
+
+  def solve(self, rack_array, board_array, time_limit=None, mip_gap=None):
+
+    if self.presolve_sets:
+      return self.solve_reduced(rack_array, board_array, time_limit, mip_gap)
+
+    # presolve=False: the full problem compiled once, only the rack and board parameters change
+    import cvxpy as cp
+
+    if self.problem is None or self.set_variable.size != len(self.game.tile_sets):
+      with PROFILER.stage('solver.build_problem'):
+        self.build_problem()
+
+    self.board_parameter.value = board_array
+    self.rack_parameter.value = rack_array
+
+    options = self.solver_options(time_limit, mip_gap)
+    start = time.perf_counter()
+    try:
+      self.problem.solve(solver=self.solver, warm_start=True, **options)
+    except cp.SolverError:
+      if time_limit is not None:
+        raise TimeoutError
+      return None
+    finally:
+      # cvxpy times its own canonicalization, the rest is the solver and unpacking the solution
+      if PROFILER.enabled:
+        compilation_time = self.problem.compilation_time or 0.0
+        PROFILER.record('solver.canonicalize', compilation_time)
+        PROFILER.record('solver.solve', time.perf_counter() - start - compilation_time, solver=self.solver)
+
+    if self.problem.status in cp.settings.INF_OR_UNB:
+      return None
+    if self.problem.status not in cp.settings.SOLUTION_PRESENT or self.tile_variable.value is None:
+      if time_limit is not None:
+        raise TimeoutError
+      return None
+
+    optimal = self.problem.status == cp.OPTIMAL and mip_gap is None
+    return self.problem.value, np.rint(self.tile_variable.value), np.rint(self.set_variable.value), optimal
+
+  def solve_reduced(self, rack_array, board_array, time_limit=None, mip_gap=None):
+
+    with PROFILER.stage('solver.presolve') as stage:
+      reduced = self.presolve(rack_array, board_array)
+      stage.set(sets=0 if reduced is None else len(reduced[1]))
+    if reduced is None:
+      return None
+    tiles, sets, set_bounds = reduced
+
+    tile_solution = np.zeros(len(self.game.tiles_unique))
+    set_solution = np.zeros(len(self.game.tile_sets))
+    if len(sets) == 0:
+      return 0, tile_solution, set_solution, True
+
+    # Tiles that are not on the rack are fixed at zero and only appear through the board counts.
+    # The reduced problem changes shape every turn, so it goes straight to the solver instead of
+    # being canonicalized by cvxpy again: [sets | -tiles] @ [x, t] == board, 0 <= [x, t] <= bounds
+    with PROFILER.stage('solver.build_arrays'):
+      rack = rack_array[tiles]
+      playable = np.flatnonzero(rack > 0)
+      placed = sparse.csc_matrix((-np.ones(len(playable)), (playable, np.arange(len(playable)))), shape=(len(tiles), len(playable)))
+      equality_matrix = sparse.hstack([self.game.sets_matrix[tiles][:, sets], placed]).tocoo()
+      equality_vector = board_array[tiles].astype(float)
+      upper_bounds = np.concatenate([set_bounds, rack[playable]]).astype(float)
+      cost = np.concatenate([np.zeros(len(sets)), -self.game.tiles_value_array[tiles][playable]]).astype(float)
+
+    with PROFILER.stage('solver.solve', solver=self.solver):
+      x, optimal = self.solve_milp(cost, equality_matrix, equality_vector, upper_bounds, time_limit, mip_gap)
+    if x is None:
+      return None
+
+    set_variable = x[:len(sets)]
+    tile_variable = x[len(sets):]
+    value = -(cost @ x)
+
+    tile_solution[tiles[playable]] = np.rint(tile_variable)
+    set_solution[sets] = np.rint(set_variable)
+    return value, tile_solution, set_solution, optimal
+
+  def solve_milp(self, cost, equality_matrix, equality_vector, upper_bounds, time_limit=None, mip_gap=None,
+      inequality_matrix=None, inequality_vector=None):
+    # Minimizes cost @ x over integers 0 <= x <= upper_bounds on GLPK or HiGHS, returns (x, optimal)
+    if self.solver == 'GLPK_MI':
+      return self.solve_glpk(cost, equality_matrix, equality_vector, upper_bounds, time_limit, mip_gap,
+        inequality_matrix, inequality_vector)
+
+    from scipy import optimize
+    options = {}
+    if time_limit is not None:
+      options['time_limit'] = time_limit
+    if mip_gap is not None:
+      options['mip_rel_gap'] = mip_gap
+    constraints = [optimize.LinearConstraint(equality_matrix, equality_vector, equality_vector)]
+    if inequality_matrix is not None:
+      constraints.append(optimize.LinearConstraint(inequality_matrix, -np.inf, inequality_vector))
+    result = optimize.milp(cost, integrality=np.ones(len(cost)), bounds=optimize.Bounds(0, upper_bounds),
+      constraints=constraints, options=options)
+    if result.status == 1 and result.x is None:
+      raise TimeoutError
+    return result.x, result.status == 0 and mip_gap is None
+
+  def solve_glpk(self, cost, equality_matrix, equality_vector, upper_bounds, time_limit=None, mip_gap=None,
+      inequality_matrix=None, inequality_vector=None):
+    import cvxopt
+    import cvxopt.glpk
+
+    def spmatrix(matrix):
+      matrix = sparse.coo_matrix(matrix)
+      return cvxopt.spmatrix(matrix.data.astype(float).tolist(), matrix.row.tolist(), matrix.col.tolist(), size=matrix.shape)
+
+    n = len(cost)
+    bounds_matrix = sparse.vstack([sparse.eye(n), -sparse.eye(n)])
+    bounds_vector = np.concatenate([upper_bounds, np.zeros(n)])
+    if inequality_matrix is None:
+      inequality_matrix, inequality_vector = bounds_matrix, bounds_vector
+    else:
+      inequality_matrix = sparse.vstack([bounds_matrix, inequality_matrix])
+      inequality_vector = np.concatenate([bounds_vector, inequality_vector])
+
+    options = {'msg_lev': 'GLP_MSG_OFF'}
+    if time_limit is not None:
+      options['tm_lim'] = max(int(time_limit * 1000), 1)
+    if mip_gap:
+      options['mip_gap'] = mip_gap
+    status, x = cvxopt.glpk.ilp(cvxopt.matrix(cost), spmatrix(inequality_matrix), cvxopt.matrix(inequality_vector),
+      spmatrix(equality_matrix), cvxopt.matrix(equality_vector), set(range(n)), options=options)
+
+    # 'feasible' is an integer solution found before the time limit or within the gap
+    if status in ('optimal', 'feasible'):
+      return np.array(x).ravel(), status == 'optimal' and mip_gap is None
+    if time_limit is not None and status == 'undefined':
+      raise TimeoutError
+    return None, False
+
+class ImplicitMilpSolver(MilpSolver):
+
+  # The same move as MilpSolver without the joker variants of runs longer than the minimum, which grow
+  # exponentially with the run length. A joker takes the place of an inner tile of such a run through a
+  # substitution count y <= x instead: [sets | substitutions | -tiles] @ [x, y, t] == board, where a
+  # substitution gives back the replaced tile and takes a joker. Groups and sets of the minimum length
+  # keep their listed variants, so every move has one representation. Moves are mapped back onto
+  # Game.tile_sets. Top-k moves use the catalogue as it is, which on a lazy catalogue (Game(lazy_jokers=True))
+  # only holds the long joker runs added so far.
+
+  def __init__(self, game, solver='GLPK_MI'):
+    super().__init__(game, solver)
+
+    codes, types = game.tile_set_codes()
+    lengths = np.count_nonzero(codes, axis=1)
+    jokers = (codes == TileType.JOKER.value*1000).any(axis=1)
+    long_runs = (types == SetType.RUN.value) & (lengths > game.min_set_length)
+    self.sets = np.flatnonzero(~(long_runs & jokers))
+    self.joker_row = game.tile_index.get(JokerTile())
+
+    substitutions = []
+    if self.joker_row is not None:
+      for i in np.flatnonzero(long_runs & ~jokers).tolist():
+        substitutions += [(i, p) for p in game.joker_positions(SetType.RUN, lengths[i])]
+    self.substitution_sets, self.substitution_positions = np.array(substitutions, dtype=np.int64).reshape(-1, 2).T
+    self.substitution_rows = np.searchsorted(game.tiles_code_array, codes[self.substitution_sets, self.substitution_positions])
+
+    # Columns of the listed sets and the entries a joker may stand in for
+    self.sets_matrix = game.sets_matrix[:, self.sets]
+    self.columns = np.repeat(np.arange(len(self.sets)), np.diff(self.sets_matrix.indptr))
+    entries = self.sets[self.columns] * len(game.tiles_unique) + self.sets_matrix.indices
+    self.substitutable = np.isin(entries, self.substitution_sets * len(game.tiles_unique) + self.substitution_rows)
+    self.substitution_columns = np.searchsorted(self.sets, self.substitution_sets)
+
+  def solve(self, rack_array, board_array, time_limit=None, mip_gap=None):
+
+    with PROFILER.stage('solver.presolve') as stage:
+      reduced = self.presolve_implicit(rack_array, board_array)
+      stage.set(sets=0 if reduced is None else len(reduced[1]))
+    if reduced is None:
+      return None
+    tiles, sets, set_bounds, substitutions, substitution_bounds = reduced
+
+    tile_solution = np.zeros(len(self.game.tiles_unique))
+    set_solution = np.zeros(len(self.game.tile_sets))
+    if len(sets) == 0:
+      return 0, tile_solution, set_solution, True
+
+    with PROFILER.stage('solver.build_arrays'):
+      rack = rack_array[tiles]
+      playable = np.flatnonzero(rack > 0)
+      n_sets, n_substitutions, n_playable = len(sets), len(substitutions), len(playable)
+      n = n_sets + n_substitutions + n_playable
+
+      tile_rows = np.full(len(self.game.tiles_unique), -1)
+      tile_rows[tiles] = np.arange(len(tiles))
+      substitution_range = np.arange(n_substitutions)
+      joker = tile_rows[self.joker_row] if n_substitutions else 0
+      substitution_matrix = sparse.coo_matrix((np.concatenate([-np.ones(n_substitutions), np.ones(n_substitutions)]),
+        (np.concatenate([tile_rows[self.substitution_rows[substitutions]], np.full(n_substitutions, joker)]),
+         np.tile(substitution_range, 2))), shape=(len(tiles), n_substitutions))
+      placed = sparse.csc_matrix((-np.ones(n_playable), (playable, np.arange(n_playable))), shape=(len(tiles), n_playable))
+      equality_matrix = sparse.hstack([self.sets_matrix[tiles][:, sets], substitution_matrix, placed]).tocoo()
+      equality_vector = board_array[tiles].astype(float)
+      upper_bounds = np.concatenate([set_bounds, substitution_bounds, rack[playable]]).astype(float)
+      cost = np.concatenate([np.zeros(n_sets + n_substitutions), -self.game.tiles_value_array[tiles][playable]]).astype(float)
+
+      # y <= x of its run
+      inequality_matrix = inequality_vector = None
+      if n_substitutions:
+        run_columns = np.searchsorted(sets, self.substitution_columns[substitutions])
+        inequality_matrix = sparse.coo_matrix((np.concatenate([np.ones(n_substitutions), -np.ones(n_substitutions)]),
+          (np.tile(substitution_range, 2), np.concatenate([n_sets + substitution_range, run_columns]))),
+          shape=(n_substitutions, n)).tocsr()
+        inequality_vector = np.zeros(n_substitutions)
+
+    with PROFILER.stage('solver.solve', solver=self.solver):
+      x, optimal = self.solve_milp(cost, equality_matrix, equality_vector, upper_bounds, time_limit, mip_gap,
+        inequality_matrix, inequality_vector)
+    if x is None:
+      return None
+
+    x = np.rint(x)
+    tile_solution[tiles[playable]] = x[n_sets + n_substitutions:]
+    substituted = substitutions[x[n_sets:n_sets + n_substitutions] > 0]
+    counts = x[n_sets:n_sets + n_substitutions][x[n_sets:n_sets + n_substitutions] > 0]
+    joker_runs = []
+    for run in np.unique(self.substitution_sets[substituted]).tolist():
+      # Copy c of a run takes a joker at every position substituted more than c times
+      mask = self.substitution_sets[substituted] == run
+      positions, position_counts = self.substitution_positions[substituted][mask], counts[mask]
+      for copy in range(int(position_counts.max())):
+        joker_runs.append((run, self.joker_run(run, positions[position_counts > copy])))
+
+    # Joker runs a lazy catalogue adds on the way come after the sets the solution was sized for
+    set_solution = np.zeros(len(self.game.tile_sets))
+    set_solution[self.sets[sets]] = x[:n_sets]
+    for run, joker_run in joker_runs:
+      set_solution[run] -= 1
+      set_solution[joker_run] += 1
+    return -(cost @ x), tile_solution, set_solution, optimal
+
+  def presolve_implicit(self, rack_array, board_array):
+    # Solver.presolve over the listed sets with jokers standing in for the inner tiles of long runs.
+    # Returns the remaining tile rows, sets (columns of self.sets), set bounds, substitutions and
+    # substitution bounds, or None if some board tile can no longer be placed.
+    available = rack_array + board_array
+    jokers = available[self.joker_row] if self.joker_row is not None else 0
+
+    copies = np.floor((available[self.sets_matrix.indices] + self.substitutable * jokers) / self.sets_matrix.data)
+    bounds = np.full(len(self.sets), self.game.deck_copies, dtype=float)
+    np.minimum.at(bounds, self.columns, copies)
+
+    sets = np.flatnonzero(bounds > 0)
+    substitutions = np.flatnonzero(bounds[self.substitution_columns] > 0) if jokers > 0 else np.zeros(0, dtype=np.int64)
+    substitution_bounds = np.minimum(bounds[self.substitution_columns[substitutions]], jokers)
+
+    used = np.zeros(self.sets_matrix.shape[0], dtype=bool)
+    used[self.sets_matrix[:, sets].indices] = True
+    if len(substitutions):
+      used[self.joker_row] = True
+    if (board_array[~used] > 0).any():
+      return None
+    return np.flatnonzero(used), sets, bounds[sets], substitutions, substitution_bounds
+
+  def joker_run(self, run, positions):
+    tile_set = self.game.tile_sets[run]
+    codes = list(tile_set.codes)
+    for position in positions.tolist():
+      codes[position] = TileType.JOKER.value*1000
+    return self.game.set_index(self.game.Board.Run.from_codes(codes))
+
+class DynamicProgrammingSolver(Solver):
+
+  # Sweeps the tile values in order, one color at a time. An open run is a window (length, starts
+  # with joker, ends with joker) under the same length and joker rules as the catalogue built in
+  # Game.tile_set_blocks, so every move maps back onto Game.tile_sets. Which open run of a color
+  # takes which tile does not change the tiles used, so the state of a color is the set of run
+  # multisets it can be in, interned as an int, and the sweep only branches on how many tiles of a
+  # color go into runs and groups and how many jokers its runs take. The states of all colors, the
+  # tiles waiting for groups and the jokers left are packed into one int64 key, and every layer is
+  # stepped as a whole with NumPy. A key is dropped once its gain plus all rack tiles still ahead
+  # cannot beat the move a first, beam limited sweep found.
+
+  BEAM = 256
+
+  def __init__(self, game):
+    super().__init__(game)
+
+    self.colors = sorted(game.deck_tile_colors, key=lambda x: x.value)
+    self.numbers = sorted(game.deck_tile_numbers)
+    self.min_length = game.min_set_length
+    self.max_length = game.min_set_length*2 - 1
+
+    self.rows = np.array([[game.tile_index[NumberTile(color, number)] for number in self.numbers] for color in self.colors])
+    self.codes = [[NumberTile(color, number).code for number in self.numbers] for color in self.colors]
+    self.joker = JokerTile()
+    self.joker_row = game.tile_index.get(self.joker)
+
+    self.group_memo = {}
+
+    # Interned color states, 0 is a color without open runs. Steps between them do not depend on
+    # the position solved, so they are kept across solves.
+    self.color_states = [frozenset([()])]
+    self.color_state_ids = {self.color_states[0]: 0}
+    self.steps = {}
+    self.group_bits = 3 * game.deck_copies
+
+  def closable(self, run):
+    length, start_joker, last_joker = run
+    return length == self.min_length or (length > self.min_length and not start_joker and not last_joker)
+
+  def window(self, length, start_joker, last_joker):
+    # Whether a run ends with a joker only matters while it is longer than the minimum and can still grow
+    if start_joker or length <= self.min_length or length >= self.max_length:
+      last_joker = False
+    return (length, start_joker, last_joker)
+
+  def missing(self, run):
+    # Values a run needs at least before it can be closed
+    length, start_joker, last_joker = run
+    if length < self.min_length:
+      return self.min_length - length
+    return 1 if last_joker else 0
+
+  def extend(self, runs, real, jokers, can_start, can_start_joker, remaining):
+    # Yields (next runs, actions, new runs, new joker runs) for every way to put real tiles and jokers
+    # of the current value into the open runs and new runs. An open run that takes no tile is closed.
+    actions = []
+    for run in runs:
+      length, start_joker, last_joker = run
+      run_actions = []
+      # Runs starting with a joker are only valid at the minimum length
+      if length < (self.min_length if start_joker else self.max_length):
+        run_actions.append('R')
+        if length+1 < self.max_length:
+          run_actions.append('J')
+      if self.closable(run):
+        run_actions.append('C')
+      actions.append(run_actions)
+
+    for combination in product(*actions):
+      new_runs = real - combination.count('R')
+      new_joker_runs = jokers - combination.count('J')
+      if new_runs < 0 or new_joker_runs < 0 or (new_runs and not can_start) or (new_joker_runs and not can_start_joker):
+        continue
+      next_runs = [self.window(run[0]+1, run[1], action == 'J') for run, action in zip(runs, combination) if action != 'C']
+      next_runs += [(1, False, False)] * new_runs + [(1, True, False)] * new_joker_runs
+      if any(self.missing(run) > remaining for run in next_runs):
+        continue
+      yield tuple(sorted(next_runs)), combination, new_runs, new_joker_runs
+
+  def dominates(self, run, other):
+    # Whether run can be closed after every sequence of tiles other can be closed after
+    if run == other:
+      return True
+    length, start_joker, last_joker = run
+    other_length, other_start_joker, other_last_joker = other
+    if start_joker:
+      return False
+    if other_start_joker:
+      return length == other_length or (other_length == self.min_length and self.closable(run))
+    return self.min_length <= length <= other_length and (not last_joker or other_last_joker)
+
+  def undominated(self, reached):
+    # Drops every run multiset whose runs are each dominated by a run of another multiset
+    def dominated(runs, others):
+      return others != runs and any(all(map(self.dominates, order, runs)) for order in permutations(others))
+    return frozenset([runs for runs in reached if not any(dominated(runs, others) for others in reached)])
+
+  def color_step(self, state, real, jokers, can_start, can_start_joker, remaining):
+    # Interned color state after the current value, or -1 if no run multiset is left
+    key = (state, real, jokers, can_start, can_start_joker, remaining)
+    next_state = self.steps.get(key)
+    if next_state is None:
+      reached = self.undominated(frozenset([next_runs for runs in self.color_states[state]
+        for next_runs, _, _, _ in self.extend(runs, real, jokers, can_start, can_start_joker, remaining)]))
+      if not reached:
+        next_state = -1
+      elif reached in self.color_state_ids:
+        next_state = self.color_state_ids[reached]
+      else:
+        next_state = self.color_state_ids[reached] = len(self.color_states)
+        self.color_states.append(reached)
+      self.steps[key] = next_state
+    return next_state
+
+  def group_options(self, counts):
+    # Maps the number of jokers needed to one way of splitting the tiles of a value into groups
+    if counts in self.group_memo:
+      return self.group_memo[counts]
+
+    options = {}
+    colors = [c for c, count in enumerate(counts) if count > 0]
+    if len(colors) == 0:
+      options[0] = []
+    elif len(self.colors) >= self.min_length:
+      first, others = colors[0], colors[1:]
+      for size in range(len(others)+1):
+        for comb in combinations(others, size):
+          members = (first,) + comb
+          jokers = max(self.min_length - len(members), 0)
+          rest = list(counts)
+          for c in members:
+            rest[c] -= 1
+          for rest_jokers, groups in self.group_options(tuple(rest)).items():
+            options.setdefault(jokers + rest_jokers, [members] + groups)
+
+    self.group_memo[counts] = options
+    return options
+
+  def grouped_counts(self, grouped):
+    # Group options only depend on how many colors give one, two, ... tiles, which grouped counts in 3 bit fields
+    return tuple(count for count in range(self.game.deck_copies, 0, -1) for _ in range((grouped >> 3*(count-1)) & 7))
+
+  def solve(self, rack_array, board_array, time_limit=None, mip_gap=None):
+
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    n_colors, n_numbers = len(self.colors), len(self.numbers)
+    m = self.min_length
+
+    # Rack tiles that no set formable from rack + board uses can never be placed
+    reduced = self.presolve(rack_array, board_array)
+    if reduced is None:
+      return None
+    placeable = np.zeros(len(rack_array), dtype=bool)
+    placeable[reduced[0]] = True
+    available_array = np.where(placeable, rack_array + board_array, board_array)
+
+    available = available_array[self.rows].astype(int).tolist()
+    required = board_array[self.rows].astype(int).tolist()
+    if self.joker_row is not None:
+      board_jokers = int(board_array[self.joker_row])
+      total_jokers = int(available_array[self.joker_row])
+    else:
+      board_jokers = total_jokers = 0
+
+    # A run started with a joker has the minimum length and uses the same tiles as the run shifted
+    # by one value with the joker moved to the end, so it is only needed where that run would pass
+    # the last value. It also needs a real tile, and a value can only hold groups if enough colors
+    # (and jokers) are there
+    joker_starts = [[vi == n_numbers - m and (total_jokers >= m or any(available[ci][vi+1:vi+m]))
+      for vi in range(n_numbers)] for ci in range(n_colors)]
+    group_values = [sum(available[ci][vi] > 0 for ci in range(n_colors)) + total_jokers >= m
+      for vi in range(n_numbers)]
+
+    # Rack value still ahead of each color step, the bound a state can add at most
+    ahead = [0] * (n_numbers * n_colors + 1)
+    for step in range(n_numbers * n_colors - 1, -1, -1):
+      vi, ci = divmod(step, n_colors)
+      ahead[step] = ahead[step+1] + self.numbers[vi] * (available[ci][vi] - required[ci][vi])
+
+    # A narrow beam finds a move quickly, the exact sweep then only follows states that can beat it
+    flags = (available, required, joker_starts, group_values, ahead, total_jokers, board_jokers, deadline)
+    best = self.sweep(*flags, beam=self.BEAM)
+    better = self.sweep(*flags, floor=-np.inf if best is None else best[0])
+    if better is not None:
+      best = better
+    if best is None:
+      return None
+    gain, decisions = best
+    value = gain - self.joker.value * board_jokers
+    return value, *self.build_move(decisions, required, joker_starts, total_jokers, board_jokers), True
+
+  def sweep(self, available, required, joker_starts, group_values, ahead, total_jokers, board_jokers, deadline,
+            floor=-np.inf, beam=None):
+    # Best (gain, decisions) over the values above floor, None if there is none. Each layer is a
+    # sorted array of keys jokers left | tiles waiting for groups << 8 | color states << bits*c, the
+    # color states numbered in the order this sweep meets them so that a key fits into an int64
+    n_colors, n_numbers = len(self.colors), len(self.numbers)
+    m = self.min_length
+    state_shift = 8 + self.group_bits
+    state_bits = (63 - state_shift) // n_colors
+    mask = (1 << state_bits) - 1
+    group_mask = ((1 << self.group_bits) - 1) << 8
+    local_states = [[0] for _ in range(n_colors)]
+    local_ids = [{0: 0} for _ in range(n_colors)]
+
+    keys = np.array([total_jokers], dtype=np.int64)
+    gains = np.zeros(1, dtype=np.int64)
+    history = []
+
+    for vi in range(n_numbers):
+      number = self.numbers[vi]
+      can_start = n_numbers - vi >= m
+      remaining = min(n_numbers - vi - 1, m)
+
+      for ci in range(n_colors):
+        if deadline is not None and time.perf_counter() > deadline:
+          raise TimeoutError
+        low, high = required[ci][vi], available[ci][vi]
+        can_start_joker = can_start and joker_starts[ci][vi]
+        shift = state_shift + state_bits * ci
+
+        jokers = keys & 0xff
+        alive = gains + ahead[vi * n_colors + ci] + self.joker.value * jokers > floor
+        unique, inverse = np.unique((keys >> shift) & mask, return_inverse=True)
+        base = keys & np.int64(~(mask << shift))
+
+        parts, actions = [], []
+        for used in range(low, high+1):
+          for grouped in range(used+1 if group_values[vi] else 1):
+            for run_jokers in range(int(jokers.max())+1):
+              steps = []
+              for state in unique.tolist():
+                next_state = self.color_step(local_states[ci][state], used - grouped, run_jokers, can_start, can_start_joker, remaining)
+                if next_state >= 0 and next_state not in local_ids[ci]:
+                  local_ids[ci][next_state] = len(local_states[ci])
+                  local_states[ci].append(next_state)
+                steps.append(local_ids[ci].get(next_state, -1))
+              next_states = np.array(steps, dtype=np.int64)[inverse]
+              rows = np.flatnonzero(alive & (next_states >= 0) & (jokers >= run_jokers))
+              if len(rows):
+                increment = (1 << (8 + 3*(grouped-1)) if grouped else 0) - run_jokers
+                parts.append((base[rows] + (next_states[rows] << shift) + increment,
+                  gains[rows] + number * (used - low) + self.joker.value * run_jokers, rows, len(actions)))
+              actions.append((used, grouped, run_jokers))
+        if len(local_states[ci]) > mask:
+          raise OverflowError('Too many color states to pack into a key')
+        keys, gains = self.merge(parts, actions, history, beam)
+        if len(keys) == 0:
+          return None
+
+      # Tiles put aside for groups at this value are split into groups, jokers fill up short ones
+      jokers = keys & 0xff
+      unique, inverse = np.unique(keys & group_mask, return_inverse=True)
+      base = keys & np.int64(~group_mask)
+      parts, actions = [], []
+      for u, grouped in enumerate(unique.tolist()):
+        selected = np.flatnonzero(inverse == u)
+        for group_jokers in self.group_options(self.grouped_counts(grouped >> 8)):
+          rows = selected[jokers[selected] >= group_jokers]
+          if len(rows):
+            parts.append((base[rows] - group_jokers, gains[rows] + self.joker.value * group_jokers, rows, len(actions)))
+          actions.append((group_jokers,))
+      keys, gains = self.merge(parts, actions, history, beam)
+      if len(keys) == 0:
+        return None
+
+    # Every state left closes all its runs, board jokers have to be placed again
+    finals = np.flatnonzero(total_jokers - (keys & 0xff) >= board_jokers)
+    if len(finals) == 0:
+      return None
+    row = finals[np.argmax(gains[finals])]
+    if gains[row] <= floor:
+      return None
+    gain = int(gains[row])
+    decisions = []
+    for parents, action_ids, actions in reversed(history):
+      decisions.append(actions[action_ids[row]])
+      row = parents[row]
+    decisions.reverse()
+    return gain, decisions
+
+  def merge(self, parts, actions, history, beam):
+    # Keeps the best gain of every key, or of the beam best keys, and records where each came from
+    if not parts:
+      history.append((np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), actions))
+      return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    keys = np.concatenate([part[0] for part in parts])
+    gains = np.concatenate([part[1] for part in parts])
+    parents = np.concatenate([part[2] for part in parts])
+    action_ids = np.concatenate([np.full(len(part[0]), part[3]) for part in parts])
+    order = np.lexsort((-gains, keys))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = keys[order[1:]] != keys[order[:-1]]
+    order = order[first]
+    if beam is not None and len(order) > beam:
+      order = order[np.argpartition(-(gains[order] + self.joker.value * (keys[order] & 0xff)), beam)[:beam]]
+    history.append((parents[order], action_ids[order], actions))
+    return keys[order], gains[order]
+
+  def build_move(self, decisions, required, joker_starts, total_jokers, board_jokers):
+    # Turns the decisions of every step into runs and groups
+    n_colors, n_numbers = len(self.colors), len(self.numbers)
+
+    tiles = np.zeros(len(self.game.tiles_unique))
+    indices = []
+
+    def add_set(set_class, codes):
+      indices.append(self.game.set_index(set_class.from_codes(codes)))
+
+    runs = [[] for _ in range(n_colors)]
+    jokers = total_jokers
+    for vi in range(n_numbers):
+      steps = decisions[vi * (n_colors+1):(vi+1) * (n_colors+1)]
+      grouped = []
+      for ci, (used, group, run_jokers) in enumerate(steps[:n_colors]):
+        tiles[self.rows[ci][vi]] = used - required[ci][vi]
+        grouped.append(group)
+        runs[ci].append((used - group, run_jokers))
+        jokers -= run_jokers
+      group_jokers, = steps[n_colors]
+      for members in self.group_options(tuple(grouped))[group_jokers]:
+        codes = [self.codes[ci][vi] for ci in members]
+        add_set(self.game.Board.Group, codes + [self.joker.code]*max(self.min_length - len(members), 0))
+      jokers -= group_jokers
+
+    for ci in range(n_colors):
+      for codes in self.build_runs(ci, runs[ci], joker_starts[ci]):
+        add_set(self.game.Board.Run, codes)
+
+    if self.joker_row is not None:
+      tiles[self.joker_row] = total_jokers - jokers - board_jokers
+    # Sized after the sets are looked up, a lazy catalogue may add joker runs on the way
+    sets = np.zeros(len(self.game.tile_sets))
+    np.add.at(sets, indices, 1)
+    return tiles, sets
+
+  def build_runs(self, ci, decisions, joker_starts):
+    # Picks one run multiset of the color at every value that leads to a closed end, back to front,
+    # then lays the actual tiles along the chosen actions
+    n_numbers, m = len(self.numbers), self.min_length
+
+    def flags(vi):
+      can_start = n_numbers - vi >= m
+      return can_start, can_start and joker_starts[vi], min(n_numbers - vi - 1, m)
+
+    # Multisets reachable at each value, forwards
+    reachable = [{()}]
+    for vi, (real, run_jokers) in enumerate(decisions):
+      reachable.append({next_runs for runs in reachable[-1]
+        for next_runs, _, _, _ in self.extend(runs, real, run_jokers, *flags(vi))})
+
+    path = []
+    target = next(iter(reachable[-1]))
+    for vi in range(n_numbers - 1, -1, -1):
+      real, run_jokers = decisions[vi]
+      path.append(next((runs, combination, new_runs, new_joker_runs) for runs in reachable[vi]
+        for next_runs, combination, new_runs, new_joker_runs in self.extend(runs, real, run_jokers, *flags(vi))
+        if next_runs == target))
+      target = path[-1][0]
+    path.reverse()
+
+    open_runs = []
+    for vi, (runs, combination, new_runs, new_joker_runs) in enumerate(path):
+      code = self.codes[ci][vi]
+      next_open_runs = []
+      for run, action in zip(runs, combination):
+        concrete = next(x for x in open_runs if x[0] == run)
+        open_runs.remove(concrete)
+        match action:
+          case 'R':
+            next_open_runs.append((self.window(run[0]+1, run[1], False), concrete[1] + [code]))
+          case 'J':
+            next_open_runs.append((self.window(run[0]+1, run[1], True), concrete[1] + [self.joker.code]))
+          case 'C':
+            yield concrete[1]
+      next_open_runs += [((1, False, False), [code]) for _ in range(new_runs)]
+      next_open_runs += [((1, True, False), [self.joker.code]) for _ in range(new_joker_runs)]
+      open_runs = next_open_runs
+    for _, codes in open_runs:
+      yield codes
+
+SOLVERS = {
+  'milp': MilpSolver,
+  'implicit': ImplicitMilpSolver,
+  'dp': DynamicProgrammingSolver,
+}
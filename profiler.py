@@ -0,0 +1,169 @@
+import time
+import json
+import tracemalloc
+import numpy as np
+
+class Profiler():
+
+  # Opt-in stage timing. While disabled, stage() hands out a shared no-op context so
+  # instrumented code pays one attribute check per stage.
+
+  def __init__(self, max_records=100000):
+    self.enabled = False
+    self.memory = False
+    self.max_records = max_records
+    self.records = []
+    self.sinks = []
+    self.depth = 0
+
+  def enable(self, memory=False):
+    # Memory is the net allocation of each stage as seen by tracemalloc, which slows Python down
+    self.enabled = True
+    self.memory = memory
+    if memory and not tracemalloc.is_tracing():
+      tracemalloc.start()
+    return self
+
+  def disable(self):
+    if self.memory and tracemalloc.is_tracing():
+      tracemalloc.stop()
+    self.enabled = False
+    self.memory = False
+    return self
+
+  def clear(self):
+    self.records = []
+
+  def add_sink(self, sink):
+    # A sink is called with every Record as it is finished
+    self.sinks.append(sink)
+    return sink
+
+  def remove_sink(self, sink):
+    self.sinks.remove(sink)
+
+  def stage(self, name, **fields):
+    if not self.enabled:
+      return NULL_STAGE
+    return self.Stage(self, name, fields)
+
+  def record(self, name, duration, memory=None, **fields):
+    # Adds a record for time measured elsewhere, e.g. the compile time cvxpy reports
+    if not self.enabled:
+      return None
+    return self.add(self.Record(name, time.time(), duration, memory, self.depth, fields))
+
+  def add(self, record):
+    if len(self.records) < self.max_records:
+      self.records.append(record)
+    for sink in self.sinks:
+      sink(record)
+    return record
+
+  def durations(self, name):
+    return np.array([record.duration for record in self.records if record.name == name])
+
+  def histogram(self, name, bins=np.logspace(-5, 1, 13)):
+    return np.histogram(self.durations(name), bins=bins)
+
+  def summary(self, q=(50, 90, 99)):
+    # Aggregates the records per stage in the order the stages first ran
+    stages = {}
+    for record in self.records:
+      stages.setdefault(record.name, []).append(record)
+    summary = {}
+    for name, records in stages.items():
+      durations = np.array([record.duration for record in records])
+      memory = [record.memory for record in records if record.memory is not None]
+      summary[name] = {
+        'count': len(records),
+        'total': durations.sum(),
+        'mean': durations.mean(),
+        'max': durations.max(),
+        **{f"p{p}": t for p, t in zip(q, np.percentile(durations, q))},
+        'memory': sum(memory) if memory else None,
+      }
+    return summary
+
+  def __str__(self):
+    lines = [f"{'Stage':<28} {'Count':>7} {'Total ms':>10} {'Mean ms':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'Memory KiB':>11}"]
+    for name, stats in self.summary().items():
+      memory = f"{stats['memory']/1024:11.1f}" if stats['memory'] is not None else f"{'-':>11}"
+      lines.append(f"{name:<28} {stats['count']:7d} {stats['total']*1000:10.2f} {stats['mean']*1000:9.3f} "
+        f"{stats['p50']*1000:9.3f} {stats['p90']*1000:9.3f} {stats['p99']*1000:9.3f} {memory}")
+    return '\n'.join(lines)
+
+  class Record():
+
+    __slots__ = ('name', 'start', 'duration', 'memory', 'depth', 'fields')
+
+    def __init__(self, name, start, duration, memory=None, depth=0, fields=None):
+      self.name = name
+      self.start = start
+      self.duration = duration
+      self.memory = memory
+      self.depth = depth
+      self.fields = fields or {}
+
+    def set(self, **fields):
+      self.fields.update(fields)
+
+    def as_dict(self):
+      return {'name': self.name, 'start': self.start, 'duration': self.duration,
+        'memory': self.memory, 'depth': self.depth, **self.fields}
+
+    def __str__(self):
+      fields = ''.join([f" {key}={value}" for key, value in self.fields.items()])
+      return f"{'  ' * self.depth}{self.name}: {self.duration*1000:.3f} ms{fields}"
+
+  class Stage():
+
+    __slots__ = ('profiler', 'record', 'started', 'allocated', 'memory')
+
+    def __init__(self, profiler, name, fields):
+      self.profiler = profiler
+      self.record = Profiler.Record(name, time.time(), 0.0, None, profiler.depth, fields)
+
+    def __enter__(self):
+      self.profiler.depth += 1
+      # Memory is measured only for stages entered while it was on, enable() may be called inside one
+      self.memory = self.profiler.memory
+      if self.memory:
+        self.allocated = tracemalloc.get_traced_memory()[0]
+      self.started = time.perf_counter()
+      return self.record
+
+    def __exit__(self, *exc):
+      self.record.duration = time.perf_counter() - self.started
+      if self.memory and tracemalloc.is_tracing():
+        self.record.memory = tracemalloc.get_traced_memory()[0] - self.allocated
+      self.profiler.depth -= 1
+      self.profiler.add(self.record)
+      return False
+
+class NullStage():
+
+  # Stands in for both the stage and its record while profiling is off
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+  def set(self, **fields):
+    pass
+
+NULL_STAGE = NullStage()
+
+def print_sink(record):
+  print(record)
+
+def jsonl_sink(path):
+  # Appends every record to a JSON lines file
+  def sink(record):
+    with open(path, 'a') as file:
+      file.write(json.dumps(record.as_dict(), default=str) + '\n')
+  return sink
+
+PROFILER = Profiler()
@@ -1,33 +1,76 @@
 from vision import Vision
 from optimizer import Tile, Game
+from profiler import PROFILER
 
 class Rummikub():
 
-  def __init__(self):
-    self.game = Game()
-    self.vision = Vision()
+  # The game and the vision model are built on first use, so optimizer-only callers never load
+  # the vision stack. All instances share one YOLO model per process (vision.load_model).
+
+  def __init__(self, game=None, vision=None):
+    self._game = game
+    self._vision = vision
+
+  @property
+  def game(self):
+    if self._game is None:
+      self._game = Game()
+    return self._game
+
+  @property
+  def vision(self):
+    if self._vision is None:
+      self._vision = Vision()
+    return self._vision
+
+  def warmup(self, vision=True, game=True):
+    # Pays the startup cost up front, e.g. before a server takes traffic
+    if game:
+      self.game.symmetries()
+    if vision:
+      self.vision.warmup()
+    return self
 
   def rack_from_image(self, img_path, player):
+    return self.rack_from_result(self.vision.predict(img_path=img_path), player)
 
-    self.vision.predict(img_path=img_path)
+  def board_from_image(self, img_path, game):
+    return self.board_from_result(self.vision.predict(img_path=img_path), game)
 
-    rack = player.rack
-    rack.tiles.clear()
-    for box in self.vision.result.boxes:
-      tile = Tile.by_name(box.cls[1].upper())
-      rack.add_tile(tile)
+  def state_from_images(self, rack_img, board_img, player):
+    # Both photos go through the model as one batch
+    rack_result, board_result = self.vision.predict(img_path=[rack_img, board_img])
+    return self.rack_from_result(rack_result, player), self.board_from_result(board_result, player.game)
+
+  def stream(self, source, player, target='board', **options):
+    # Yields the board (or the rack) of a camera or video every time its tiles change,
+    # so the optimizer only runs on real changes
+    level = 'box_set' if target == 'board' else 'box'
+    for _, result in self.vision.stream(source, level=level, **options):
+      if target == 'board':
+        yield self.board_from_result(result, player.game)
+      else:
+        yield self.rack_from_result(result, player)
+
+  def rack_from_result(self, result, player):
+
+    with PROFILER.stage('rummikub.rack_tiles'):
+      rack = player.rack
+      rack.clear()
+      for box in result.boxes:
+        tile = Tile.by_name(box.cls[1].upper())
+        rack.add_tile(tile)
 
     return rack
 
-  def board_from_image(self, img_path, game):
+  def board_from_result(self, result, game):
 
-    self.vision.predict(img_path=img_path)
-    
-    board = game.board
-    board.tile_sets.clear()
-    for box_set in self.vision.result.box_sets:
-      tile_names = [box.cls[1].upper() for box in box_set]
-      tile_set = board.TileSet.by_names(tile_names)
-      board.add_tile_set(tile_set)
+    with PROFILER.stage('rummikub.board_tile_sets'):
+      board = game.board
+      board.clear()
+      for box_set in result.box_sets:
+        tile_names = [box.cls[1].upper() for box in box_set]
+        tile_set = board.TileSet.by_names(tile_names)
+        board.add_tile_set(tile_set)
 
     return board
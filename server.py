@@ -0,0 +1,253 @@
+import os
+import json
+import base64
+import asyncio
+import argparse
+from http import HTTPStatus
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from optimizer import Game, Tile, _init_pool, _solve_state
+from rummikub import Rummikub
+
+MAX_BODY = 32 * 1024 * 1024
+
+class Server():
+
+  # Keeps the model and the set catalogue resident for every client. Images from concurrent
+  # requests are micro-batched into single model calls, solves run in a process pool so the
+  # event loop only ever parses requests and waits. Every solver process keeps a solve cache.
+  #
+  #   POST /move  {"rack": ["RED_1", ...], "board": [["BLUE_3", "BLUE_4", "BLUE_5"], ...], "initial_play": false}
+  #               {"rack_image": <base64>, "board_image": <base64>}
+  #   GET /health
+
+  def __init__(self, host='127.0.0.1', port=8000, processes=None, backend='milp', backend_options=None,
+      batch_window=0.01, max_batch=8, game=None, vision=None, images=True):
+    # images=False serves tile names only, photos are rejected and the model is never loaded
+    self.host = host
+    self.port = port
+    self.processes = processes
+    self.images = images
+    self.rummikub = Rummikub(game=game, vision=vision)
+    self.pool = ProcessPoolExecutor(processes, initializer=_init_pool,
+      initargs=(self.game.config, backend, backend_options or {}, True))
+    self.batcher = self.Batcher(self.rummikub, batch_window, max_batch)
+
+  @property
+  def game(self):
+    return self.rummikub.game
+
+  def warmup(self, vision=True):
+    # Loads the model and starts every solver process before the first request
+    self.rummikub.warmup(vision=vision)
+    empty = np.zeros(len(self.game.tiles_unique))
+    futures = [self.pool.submit(_solve_state, (empty, empty, False)) for _ in range(self.processes or os.cpu_count())]
+    for future in futures:
+      future.result()
+    return self
+
+  def run(self):
+    asyncio.run(self.serve())
+
+  async def serve(self):
+    server = await asyncio.start_server(self.handle, self.host, self.port)
+    print(f"Serving on http://{self.host}:{self.port}")
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      self.close()
+
+  def close(self):
+    self.pool.shutdown(cancel_futures=True)
+    self.batcher.executor.shutdown()
+
+  async def handle(self, reader, writer):
+    try:
+      while True:
+        request_line = await reader.readline()
+        if not request_line.strip():
+          break
+        method, path, version = request_line.decode('latin-1').split()
+        headers = {}
+        while True:
+          line = await reader.readline()
+          if line in (b'\r\n', b'\n', b''):
+            break
+          key, _, value = line.decode('latin-1').partition(':')
+          headers[key.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+          status, payload = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {'error': f"Body larger than {MAX_BODY} bytes"}
+          keep_alive = False
+        else:
+          body = await reader.readexactly(length)
+          status, payload = await self.route(method, path.split('?', 1)[0], body)
+          keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        data = json.dumps(payload).encode()
+        writer.write((f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+          f"Content-Type: application/json\r\n"
+          f"Content-Length: {len(data)}\r\n"
+          f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + data)
+        await writer.drain()
+        if not keep_alive:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+      pass
+    finally:
+      writer.close()
+
+  async def route(self, method, path, body):
+    match method, path:
+      case 'GET', '/health':
+        return HTTPStatus.OK, {'status': 'ok'}
+      case 'POST', '/move':
+        try:
+          request = json.loads(body)
+          return HTTPStatus.OK, await self.move(request)
+        except (json.JSONDecodeError, KeyError, IndexError, ValueError, TypeError) as e:
+          return HTTPStatus.BAD_REQUEST, {'error': f"{type(e).__name__}: {e}"}
+        except Exception as e:
+          return HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f"{type(e).__name__}: {e}"}
+      case _, '/health' | '/move':
+        return HTTPStatus.METHOD_NOT_ALLOWED, {'error': f"{method} not allowed on {path}"}
+      case _:
+        return HTTPStatus.NOT_FOUND, {'error': f"Unknown path {path}"}
+
+  async def move(self, request):
+    # The rack and the board come as tile names or as photos, photos of one request share a batch
+    if not self.images and any(f"{key}_image" in request for key in ('rack', 'board')):
+      raise ValueError('This server takes tile names only, photos are disabled')
+    images = {key: decode_image(request[f"{key}_image"]) for key in ('rack', 'board') if f"{key}_image" in request}
+    results = await asyncio.gather(*[self.batcher.predict(image) for image in images.values()])
+    results = dict(zip(images, results))
+
+    if 'rack' in results:
+      rack = [box.cls[1] for box in results['rack'].boxes]
+    else:
+      rack = request['rack']
+    if 'board' in results:
+      board = [[box.cls[1] for box in box_set] for box_set in results['board'].box_sets]
+    else:
+      board = request.get('board', [])
+    rack = [self.tile(name) for name in rack]
+    board = [[self.tile(name) for name in names] for names in board]
+    initial_play = bool(request.get('initial_play', False))
+
+    rack_array = self.tile_counts(rack)
+    board_array = self.tile_counts([tile for tiles in board for tile in tiles])
+
+    loop = asyncio.get_running_loop()
+    solved, value, tiles, sets, joker_runs = await loop.run_in_executor(self.pool, _solve_state, (rack_array, board_array, initial_play))
+    sets = self.game.adopt_sets(sets, joker_runs)
+
+    return {
+      'rack': [tile.name for tile in rack],
+      'board': [[tile.name for tile in tiles] for tiles in board],
+      'solved': bool(solved),
+      'value': float(value) if value is not None else 0.0,
+      'tiles': self.tile_names(tiles),
+      'sets': [[tile.name for tile in self.game.tile_sets[i].tiles] for i in np.flatnonzero(sets) for _ in range(int(sets[i]))],
+    }
+
+  def tile(self, name):
+    # Only names of this game's tiles, looked up without interning anything a client sends
+    code = self.game.tile_map_reversed.get(name.upper()) if isinstance(name, str) else None
+    if code is None:
+      raise ValueError(f"Unknown tile {name!r}")
+    return Tile.by_code(code)
+
+  def tile_counts(self, tiles):
+    counts = np.zeros(len(self.game.tiles_unique))
+    for tile in tiles:
+      counts[self.game.tile_index[tile]] += 1
+    return counts
+
+  def tile_names(self, counts):
+    return [tile.name for tile, count in zip(self.game.tiles_unique, counts) for _ in range(int(round(count)))]
+
+  class Batcher():
+
+    # Images that arrive within window seconds of each other go through the model as one batch.
+    # A single inference thread runs the batches one after another, so while one batch runs the
+    # next one fills up.
+
+    def __init__(self, rummikub, window=0.01, max_batch=8):
+      self.rummikub = rummikub
+      self.window = window
+      self.max_batch = max_batch
+      self.pending = []
+      self.timer = None
+      self.executor = ThreadPoolExecutor(1)
+      # The event loop only keeps weak references to tasks, running batches are kept here
+      self.tasks = set()
+
+    async def predict(self, image):
+      loop = asyncio.get_running_loop()
+      future = loop.create_future()
+      self.pending.append((image, future))
+      if len(self.pending) >= self.max_batch:
+        self.flush()
+      elif self.timer is None:
+        self.timer = loop.call_later(self.window, self.flush)
+      return await future
+
+    def flush(self):
+      if self.timer is not None:
+        self.timer.cancel()
+        self.timer = None
+      pending, self.pending = self.pending, []
+      if pending:
+        task = asyncio.ensure_future(self.run(pending))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, pending):
+      loop = asyncio.get_running_loop()
+      images = [image for image, _ in pending]
+      try:
+        results = await loop.run_in_executor(self.executor, self.infer, images)
+      except Exception as e:
+        for _, future in pending:
+          if not future.done():
+            future.set_exception(e)
+        return
+      for (_, future), result in zip(pending, results):
+        if not future.done():
+          future.set_result(result)
+
+    def infer(self, images):
+      return self.rummikub.vision.predict(img_path=images)
+
+def decode_image(data):
+  import cv2
+
+  image = cv2.imdecode(np.frombuffer(base64.b64decode(data), np.uint8), cv2.IMREAD_COLOR)
+  if image is None:
+    raise ValueError('Image could not be decoded')
+  return image
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Rummikub move server')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--processes', type=int, default=None)
+  parser.add_argument('--backend', default='milp', choices=['milp', 'implicit', 'dp'])
+  parser.add_argument('--vision-backend', default='torch', choices=['torch', 'onnx'])
+  parser.add_argument('--batch-window', type=float, default=0.01)
+  parser.add_argument('--max-batch', type=int, default=8)
+  parser.add_argument('--no-vision', action='store_true', help='Only accept tile names, never load the model')
+
+  args = parser.parse_args()
+
+  vision = None
+  if not args.no_vision:
+    from vision import Vision
+    vision = Vision(backend=args.vision_backend)
+  # The implicit backend places jokers in long runs itself, so it only needs the lazy catalogue
+  game = Game(lazy_jokers=args.backend == 'implicit')
+  server = Server(args.host, args.port, args.processes, args.backend,
+    batch_window=args.batch_window, max_batch=args.max_batch, game=game, vision=vision, images=not args.no_vision)
+  server.warmup(vision=not args.no_vision).run()
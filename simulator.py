@@ -0,0 +1,123 @@
+import time
+import argparse
+import multiprocessing
+import numpy as np
+from optimizer import Game
+from dataset import StateDataset
+
+class Simulator():
+
+  def __init__(self, players=4, backend='milp', max_turns=1000, time_limit=None, record=None, **game_options):
+    # record is the path of a StateDataset that gets every position a player solved
+    self.players = players
+    self.backend = backend
+    self.max_turns = max_turns
+    self.time_limit = time_limit
+    self.record = record
+    # The implicit backend places jokers in long runs itself, so its games only build the lazy catalogue
+    self.game_options = {'lazy_jokers': backend == 'implicit', **game_options}
+
+  def play_game(self, seed=None):
+
+    game = Game(seed=seed, **self.game_options)
+    for _ in range(self.players):
+      player = game.add_player()
+      player.optimizer.use_backend(self.backend)
+
+    solve_times = []
+    states = []
+    turns = 0
+    passes = 0
+    winner = None
+
+    while turns < self.max_turns:
+      player = game.players[turns % self.players]
+      turns += 1
+      if self.record is not None:
+        states.append(game.encode_state(player))
+
+      start = time.perf_counter()
+      solved, value, tiles, sets = player.optimizer.solve(self.time_limit)
+      solve_times.append(time.perf_counter() - start)
+
+      if solved:
+        player.play(tiles, sets)
+        passes = 0
+        if len(player.rack.tiles) == 0:
+          winner = player
+          break
+      elif len(game.deck.tiles) > 0:
+        player.draw_tile(verbose=False)
+        passes = 0
+      else:
+        # Nobody can play or draw for a full round
+        passes += 1
+        if passes == self.players:
+          break
+
+    if winner is None:
+      winner = min(game.players, key=lambda x: x.score)
+
+    return {
+      'seed': seed,
+      'turns': turns,
+      'winner': game.players.index(winner),
+      'scores': [player.score for player in game.players],
+      'solve_times': solve_times,
+      'states': np.array(states, dtype=game.state_dtype()),
+    }
+
+  def run(self, games=10, processes=None, seed=0):
+    seeds = [seed + i for i in range(games)]
+    start = time.perf_counter()
+    if processes == 1:
+      results = [self.play_game(seed) for seed in seeds]
+    else:
+      with multiprocessing.Pool(processes) as pool:
+        results = pool.map(self.play_game, seeds)
+    if self.record is not None:
+      dataset = StateDataset(self.record, Game(**self.game_options))
+      for result in results:
+        dataset.append(result['states'])
+    return self.Report(results, time.perf_counter() - start)
+
+  class Report():
+
+    def __init__(self, results, elapsed):
+      self.results = results
+      self.elapsed = elapsed
+      self.games = len(results)
+      self.turns = sum([result['turns'] for result in results])
+      self.solve_times = np.array([t for result in results for t in result['solve_times']])
+      self.games_per_sec = self.games / elapsed
+      self.turns_per_sec = self.turns / elapsed
+
+    def histogram(self, bins=np.logspace(-4, 1, 11)):
+      return np.histogram(self.solve_times, bins=bins)
+
+    def percentiles(self, q=(50, 90, 99)):
+      return dict(zip(q, np.percentile(self.solve_times, q))) if len(self.solve_times) else {}
+
+    def __str__(self):
+      counts, edges = self.histogram()
+      width = max(counts.max(), 1) if len(counts) else 1
+      histogram = '\n'.join([f"{edges[i]*1000:9.2f} - {edges[i+1]*1000:9.2f} ms | {'#' * int(40 * count / width)} {count}"
+        for i, count in enumerate(counts)])
+      percentiles = ', '.join([f"p{q}: {t*1000:.2f} ms" for q, t in self.percentiles().items()])
+      return f"Simulation ({self.games} Games / {self.turns} Turns in {self.elapsed:.2f} s)\n" \
+        f"Games/sec: {self.games_per_sec:.3f}\nTurns/sec: {self.turns_per_sec:.1f}\n" \
+        f"Solve latency ({percentiles}):\n{histogram}"
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Headless Rummikub self-play benchmark')
+  parser.add_argument('--games', type=int, default=10)
+  parser.add_argument('--players', type=int, default=4)
+  parser.add_argument('--processes', type=int, default=None)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--backend', default='milp')
+  parser.add_argument('--time-limit', type=float, default=None)
+  parser.add_argument('--record', default=None, help='Append every solved position to this state dataset')
+  args = parser.parse_args()
+
+  simulator = Simulator(players=args.players, backend=args.backend, time_limit=args.time_limit, record=args.record)
+  print(simulator.run(games=args.games, processes=args.processes, seed=args.seed))
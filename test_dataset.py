@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from optimizer import Game, TileColor
+from dataset import StateDataset
+
+@pytest.fixture(scope='module')
+def positions():
+  # A few turns of self-play, so the board holds sets when the later positions are recorded
+  game = Game(seed=0, cache_dir=None)
+  players = [game.add_player() for _ in range(2)]
+  records = []
+  for turn in range(12):
+    player = players[turn % 2]
+    records.append(game.encode_state(player))
+    solved, value, tiles, sets = player.optimizer.solve()
+    if solved:
+      player.play(tiles, sets)
+    else:
+      player.draw_tile(verbose=False)
+  assert records[-1]['board'].sum() > 0
+  return game, np.array(records, dtype=game.state_dtype())
+
+def test_round_trip(tmp_path, positions):
+  game, records = positions
+  path = str(tmp_path / 'positions.rks')
+  dataset = StateDataset(path, game)
+  assert dataset.append(records[:5]) == 5
+  assert dataset.append(records[5:]) == len(records) - 5
+
+  dataset = StateDataset(path, game)
+  assert len(dataset) == len(records)
+  assert dataset.records().tobytes() == records.tobytes()
+  assert sum(len(batch) for batch in dataset.batches(5)) == len(records)
+  for (rack, board, initial_play), record in zip(dataset.states(batch_size=5), records):
+    assert np.array_equal(rack, record['rack']) and np.array_equal(board, record['board'])
+    assert initial_play == bool(record['initial_play'])
+
+def test_load_state(positions):
+  game, records = positions
+  record = records[-1]
+  other = Game(seed=1, cache_dir=None)
+  player = other.add_player()
+  other.load_state(record.tobytes(), player)
+  assert np.array_equal(other.board.counts, record['board'])
+  assert np.array_equal(player.rack.counts, record['rack'])
+  assert np.array_equal(other.deck.counts, record['deck'])
+  assert sorted(other.encode_state(player)['sets']) == sorted(record['sets'])
+
+def test_partial_record(tmp_path, positions):
+  # A record cut short by a crashed writer is not read and gets overwritten by the next append
+  game, records = positions
+  path = str(tmp_path / 'positions.rks')
+  dataset = StateDataset(path, game)
+  dataset.append(records[:2])
+  with open(path, 'ab') as f:
+    f.write(records[2].tobytes()[:7])
+  assert len(dataset) == 2
+  dataset.append(records[2:4])
+  assert dataset.records().tobytes() == records[:4].tobytes()
+
+def test_other_configuration(tmp_path, positions):
+  game, records = positions
+  path = str(tmp_path / 'positions.rks')
+  StateDataset(path, game).append(records)
+  with pytest.raises(ValueError):
+    StateDataset(path, Game(deck_tile_colors=list(TileColor)[:3], cache_dir=None))
+  with pytest.raises(FileNotFoundError):
+    StateDataset(str(tmp_path / 'missing.rks'))
@@ -0,0 +1,164 @@
+import os
+import numpy as np
+import pytest
+import optimizer
+from optimizer import Game, TileColor, JokerTile, SolveCache, MilpSolver, ImplicitMilpSolver, DynamicProgrammingSolver
+
+SEED = 0
+STATES = 25
+
+def random_states(game, count, seed=SEED, board_sets=5, rack_tiles=14, rack_jokers=0):
+  # (rack, board) counts where the board is made of catalogue sets and the rack of the tiles left
+  rng = np.random.default_rng(seed)
+  sets_matrix = game.sets_matrix.tocsc()
+  joker = game.tile_index[JokerTile()]
+  states = []
+  for _ in range(count):
+    remaining = game.tiles_count_array.astype(float)
+    rack = np.zeros_like(remaining)
+    rack[joker] = min(rack_jokers, remaining[joker])
+    remaining[joker] -= rack[joker]
+    board = np.zeros_like(remaining)
+    placed = 0
+    for column in rng.integers(len(game.tile_sets), size=20 * board_sets):
+      counts = sets_matrix[:, column].toarray().ravel()
+      if (counts <= remaining).all():
+        remaining -= counts
+        board += counts
+        placed += 1
+        if placed == board_sets:
+          break
+    pool = np.repeat(np.arange(len(remaining)), remaining.astype(int))
+    np.add.at(rack, rng.choice(pool, rack_tiles - int(rack[joker]), replace=False), 1)
+    states.append((rack, board))
+  return states
+
+def check_move(game, rack, board, solution):
+  value, tiles, sets = solution[:3]
+  assert (tiles >= 0).all() and (tiles <= rack).all()
+  assert np.array_equal(game.sets_matrix @ sets, board + tiles)
+  assert game.tiles_value_array @ tiles == pytest.approx(value)
+
+@pytest.fixture(scope='module')
+def game():
+  return Game(seed=SEED)
+
+@pytest.fixture(scope='module')
+def variant():
+  return Game(deck_tile_colors=list(TileColor)[:5], deck_jokers=2, min_set_length=4, cache_dir=None, seed=SEED)
+
+def test_catalogue_file(tmp_path, monkeypatch):
+  options = dict(deck_tile_colors=list(TileColor)[:3], deck_jokers=1, cache_dir=str(tmp_path))
+  Game._catalogues.clear()
+  built = Game(**options)
+  files = os.listdir(tmp_path)
+  assert len(files) == 1 and files[0].startswith(f"tile_sets-v{optimizer.CATALOGUE_FORMAT}-")
+
+  # The same configuration reads the file back, another format version does not find it
+  Game._catalogues.clear()
+  monkeypatch.setattr(Game, 'build_tile_set_codes', lambda self: pytest.fail('catalogue built again'))
+  assert Game(**options).tile_sets == built.tile_sets
+  monkeypatch.undo()
+  Game._catalogues.clear()
+  monkeypatch.setattr(optimizer, 'CATALOGUE_FORMAT', optimizer.CATALOGUE_FORMAT + 1)
+  Game(**options)
+  assert len(os.listdir(tmp_path)) == 2
+  Game._catalogues.clear()
+
+def test_catalogue_cache_dir():
+  assert not optimizer.CACHE_DIR.startswith(os.path.dirname(os.path.abspath(optimizer.__file__)))
+
+def test_dynamic_programming_matches_milp(game):
+  milp, dp = MilpSolver(game), DynamicProgrammingSolver(game)
+  for rack, board in random_states(game, STATES):
+    expected, solution = milp.solve(rack, board), dp.solve(rack, board)
+    check_move(game, rack, board, solution)
+    assert solution[0] == pytest.approx(expected[0])
+
+def test_dynamic_programming_crowded_board(game):
+  # Crowded boards with jokers on the rack once took seconds, each must now be solved well within the limit
+  milp, dp = MilpSolver(game), DynamicProgrammingSolver(game)
+  for rack, board in random_states(game, 10, board_sets=8, rack_tiles=16, rack_jokers=2):
+    expected, solution = milp.solve(rack, board), dp.solve(rack, board, time_limit=2)
+    check_move(game, rack, board, solution)
+    assert solution[0] == pytest.approx(expected[0])
+
+@pytest.mark.parametrize('name', ['game', 'variant'])
+def test_implicit_matches_milp(name, request):
+  game = request.getfixturevalue(name)
+  milp, implicit = MilpSolver(game), ImplicitMilpSolver(game)
+  for rack, board in random_states(game, STATES):
+    expected, solution = milp.solve(rack, board), implicit.solve(rack, board)
+    check_move(game, rack, board, solution)
+    assert solution[0] == pytest.approx(expected[0])
+
+def test_top_k_moves(game):
+  milp, dp = MilpSolver(game), DynamicProgrammingSolver(game)
+  compiled = MilpSolver(game, presolve=False)
+  for rack, board in random_states(game, 4):
+    board_sets = np.zeros(len(game.tile_sets))
+    moves = milp.solve_top_k(rack, board, board_sets, 3)
+    assert moves[0][0] == pytest.approx(milp.solve(rack, board)[0])
+    assert all(first[0] >= second[0] for first, second in zip(moves, moves[1:]))
+    assert len({tuple(sets) for _, _, sets in moves}) == len(moves)
+    for move in moves:
+      check_move(game, rack, board, move)
+    # The compiled problem and the backends that hand top-k to the MILP list moves of the same values
+    for other in (compiled, dp):
+      assert [move[0] for move in other.solve_top_k(rack, board, board_sets, 3)] == pytest.approx([move[0] for move in moves])
+
+def test_unknown_solver(game):
+  with pytest.raises(ValueError):
+    MilpSolver(game, solver='CBC')
+  with pytest.raises(ValueError):
+    ImplicitMilpSolver(game, solver='glpk')
+
+def test_lazy_joker_runs(variant):
+  options = dict(deck_tile_colors=list(TileColor)[:5], deck_jokers=2, min_set_length=4, cache_dir=None, seed=SEED)
+  lazy = Game(lazy_jokers=True, **options)
+  assert len(lazy.tile_sets) < len(variant.tile_sets)
+
+  # Moves with jokers in long runs add those runs to the lazy catalogue
+  milp, implicit = MilpSolver(variant), ImplicitMilpSolver(lazy)
+  for rack, board in random_states(variant, STATES, rack_jokers=2):
+    expected, solution = milp.solve(rack, board), implicit.solve(rack, board)
+    check_move(lazy, rack, board, solution)
+    assert solution[0] == pytest.approx(expected[0])
+  assert len(lazy.joker_runs) > 0 and len(lazy.tile_sets) == len(set(lazy.tile_sets))
+
+  # A board set is added when it is counted, and counts move between copies of the game by their codes
+  other = Game(lazy_jokers=True, **options)
+  run = other.Board.Run.by_names(['BLUE_2', 'JOKER', 'BLUE_4', 'BLUE_5', 'BLUE_6'])
+  assert run not in other.tile_set_index
+  other.board.add_tile_set(run)
+  counts = other.board.set_counts()
+  assert counts[other.tile_set_index[run]] == 1 and counts.sum() == 1
+
+  adopted = lazy.adopt_sets(counts, other.joker_runs)
+  assert adopted[lazy.tile_set_index[run]] == 1 and adopted.sum() == 1
+
+def test_cache_is_opt_in(game):
+  optimizer = game.add_player().optimizer
+  assert optimizer.cache is None
+  rack, board = random_states(game, 1)[0]
+  for _ in range(2):
+    optimizer.solve_state(rack, board)
+    assert optimizer.source == 'optimal'
+
+def test_cache_recolored_state(game):
+  player = game.add_player()
+  optimizer = player.optimizer
+  optimizer.cache = SolveCache()
+  tile_maps, tile_inverses, _, _ = game.symmetries()
+
+  for rack, board in random_states(game, 4):
+    solved, value, _, _ = optimizer.solve_state(rack, board)
+    assert optimizer.source == 'optimal'
+
+    # Any color permutation of the state is answered from the same entry
+    permutation = len(tile_maps) - 1
+    recolored_rack, recolored_board = rack[tile_inverses[permutation]], board[tile_inverses[permutation]]
+    recolored = optimizer.solve_state(recolored_rack, recolored_board)
+    assert optimizer.source == 'cache'
+    assert recolored[0] == solved and recolored[1] == pytest.approx(value)
+    check_move(game, recolored_rack, recolored_board, recolored[1:])
@@ -0,0 +1,29 @@
+from profiler import Profiler
+from optimizer import Game
+
+def test_memory_enabled_inside_stage():
+  profiler = Profiler().enable()
+  with profiler.stage('outer'):
+    profiler.enable(memory=True)
+    with profiler.stage('inner'):
+      data = bytearray(1 << 20)
+    profiler.disable()
+  outer, = [record for record in profiler.records if record.name == 'outer']
+  inner, = [record for record in profiler.records if record.name == 'inner']
+  assert outer.memory is None
+  assert inner.memory >= 1 << 20
+  assert profiler.depth == 0
+
+def test_presolve_stages():
+  from profiler import PROFILER
+
+  game = Game(cache_dir=None)
+  player = game.add_player()
+  PROFILER.enable()
+  try:
+    player.optimizer.solve()
+  finally:
+    PROFILER.disable()
+  names = {record.name for record in PROFILER.records}
+  PROFILER.clear()
+  assert 'solver.build_arrays' in names and 'solver.canonicalize' not in names
@@ -0,0 +1,64 @@
+import json
+import asyncio
+import pytest
+from optimizer import Game, Tile
+from server import Server
+
+@pytest.fixture(scope='module')
+def server():
+  server = Server(processes=1, game=Game(cache_dir=None), images=False)
+  yield server
+  server.close()
+
+def post(server, request):
+  return asyncio.run(server.route('POST', '/move', json.dumps(request).encode()))
+
+def test_move(server):
+  status, payload = post(server, {'rack': ['RED_1', 'RED_2', 'red_3', 'RED_7'], 'board': [['BLUE_7', 'BLACK_7', 'ORANGE_7']]})
+  assert status.value == 200
+  assert payload['solved'] and payload['value'] == 13
+  assert payload['rack'] == ['RED_1', 'RED_2', 'RED_3', 'RED_7']
+  assert sorted(payload['tiles']) == sorted(payload['rack'])
+  assert sorted(name for names in payload['sets'] for name in names) == sorted(payload['rack'] + ['BLUE_7', 'BLACK_7', 'ORANGE_7'])
+
+@pytest.mark.parametrize('name', ['PURPLE_4', 'RED_400', 'RED_0', 'RED', 7])
+def test_unknown_tile(server, name):
+  # Names outside the game are rejected before they are interned
+  tiles = len(Tile.tiles)
+  status, payload = post(server, {'rack': ['RED_1', name]})
+  assert status.value == 400 and 'Unknown tile' in payload['error']
+  status, _ = post(server, {'rack': ['RED_1'], 'board': [['BLUE_1', name, 'BLUE_3']]})
+  assert status.value == 400
+  assert len(Tile.tiles) == tiles
+
+def test_photos_disabled(server):
+  status, payload = post(server, {'rack_image': 'aGVsbG8=', 'board': []})
+  assert status.value == 400 and 'photos are disabled' in payload['error']
+
+def test_batcher_keeps_running_batches():
+  batches = []
+
+  class Model():
+
+    def __init__(self):
+      self.vision = self
+
+    def predict(self, img_path):
+      batches.append(list(img_path))
+      return [f"result {image}" for image in img_path]
+
+  batcher = Server.Batcher(Model(), window=0.001, max_batch=2)
+
+  async def predict():
+    predictions = [asyncio.ensure_future(batcher.predict(image)) for image in range(3)]
+    await asyncio.sleep(0)
+    # The full batch runs as a task the batcher holds on to, the last image waits for the window
+    assert len(batcher.tasks) == 1
+    results = await asyncio.gather(*predictions)
+    await asyncio.sleep(0)
+    return results
+
+  assert asyncio.run(predict()) == ['result 0', 'result 1', 'result 2']
+  assert batches == [[0, 1], [2]]
+  assert not batcher.tasks
+  batcher.executor.shutdown()
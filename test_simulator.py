@@ -0,0 +1,28 @@
+import numpy as np
+from simulator import Simulator
+from dataset import StateDataset
+from optimizer import Game
+
+def test_run(tmp_path):
+  path = str(tmp_path / 'positions.rks')
+  simulator = Simulator(players=2, max_turns=20, record=path, cache_dir=None)
+  report = simulator.run(games=2, processes=1, seed=0)
+
+  assert report.games == 2
+  assert report.turns == sum(result['turns'] for result in report.results) <= 40
+  assert len(report.solve_times) == report.turns
+  assert report.histogram()[0].sum() <= report.turns
+  assert set(report.percentiles()) == {50, 90, 99}
+  assert 'Games/sec' in str(report)
+  for result in report.results:
+    assert len(result['scores']) == 2 and result['winner'] in (0, 1)
+
+  # Every solved position was recorded, in the order of the games
+  dataset = StateDataset(path, Game(cache_dir=None))
+  assert len(dataset) == report.turns
+  assert dataset.records().tobytes() == np.concatenate([result['states'] for result in report.results]).tobytes()
+
+def test_seeded():
+  simulator = Simulator(players=2, max_turns=10, cache_dir=None)
+  first, second = simulator.play_game(seed=3), simulator.play_game(seed=3)
+  assert first['turns'] == second['turns'] and first['scores'] == second['scores']
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from vision import Vision, Detections
+
+NAMES = {0: 'red_1', 1: 'red_2', 2: 'red_3', 3: 'blue_1'}
+
+def result(boxes):
+  rows = [[x, y, x + width, y + height, 0.9, cls] for x, y, width, height, cls in boxes]
+  return Vision.Result(Detections(np.zeros((400, 600, 3), np.uint8), NAMES, rows))
+
+def classes(box_sets):
+  return [[box.cls[0] for box in box_set] for box_set in box_sets]
+
+def components(boxes, margin=5):
+  # Brute-force connected components of the intersectsWith graph, as sets of box indices
+  remaining = set(range(len(boxes)))
+  found = []
+  while remaining:
+    stack = [remaining.pop()]
+    component = set(stack)
+    while stack:
+      i = stack.pop()
+      for j in list(remaining):
+        if boxes[i].intersectsWith(boxes[j], margin) or boxes[j].intersectsWith(boxes[i], margin):
+          remaining.discard(j)
+          component.add(j)
+          stack.append(j)
+    found.append(frozenset(component))
+  return set(found)
+
+def test_rows():
+  # Two rows of touching tiles, given out of order, each becomes one set listed left to right
+  detections = result([(44, 10, 20, 30, 2), (10, 100, 20, 30, 3), (0, 10, 20, 30, 0), (22, 10, 20, 30, 1)])
+  assert classes(detections.box_sets) == [[0, 1, 2], [3]]
+
+def test_chain():
+  # The middle tile joins two tiles that do not touch each other, even when it is found last
+  detections = result([(0, 0, 20, 30, 0), (48, 0, 20, 30, 2), (24, 0, 20, 30, 1)])
+  assert classes(detections.box_sets) == [[0, 1, 2]]
+
+def test_empty():
+  assert result([]).box_sets == []
+
+@pytest.mark.parametrize('seed', range(5))
+def test_matches_brute_force(seed):
+  rng = np.random.default_rng(seed)
+  boxes = [(int(x), int(y), 20, 30, 0) for x, y in rng.integers(0, 300, (40, 2))]
+  detections = result(boxes)
+  index = {id(box): i for i, box in enumerate(detections.boxes)}
+  box_sets = {frozenset(index[id(box)] for box in box_set) for box_set in detections.box_sets}
+  assert box_sets == components(detections.boxes)
+  for box_set in detections.box_sets:
+    assert [box.x for box in box_set] == sorted(box.x for box in box_set)
@@ -1,22 +1,463 @@
 import os
-import cv2
-from ultralytics import YOLO
+import ast
+import threading
+import numpy as np
+from profiler import PROFILER
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), 'model/rummikub.pt')
+
+_models = {}
+_models_lock = threading.Lock()
+
+def load_model(path=MODEL_PATH, backend='torch', quantize=False, threads=None):
+  # One model per weights file, backend and settings in each process, loaded on first use.
+  # ultralytics, torch and onnxruntime are only imported here and in export_onnx, so importing this
+  # module stays cheap and the ONNX backend runs without ultralytics once the model is exported.
+  key = (path, backend, quantize, threads)
+  model = _models.get(key)
+  if model is None:
+    with _models_lock:
+      model = _models.get(key)
+      if model is None:
+        with PROFILER.stage('vision.load_model', backend=backend):
+          match backend:
+            case 'torch':
+              from ultralytics import YOLO
+              model = YOLO(path)
+            case 'onnx':
+              model = OnnxModel(export_onnx(path, quantize), threads=threads)
+            case _:
+              raise ValueError(f"Unknown vision backend: {backend}")
+          _models[key] = model
+  return model
+
+def export_onnx(path=MODEL_PATH, quantize=False, imgsz=640):
+  # Exports the weights to ONNX next to the .pt file, again only when the .pt file is newer.
+  # The INT8 model is the FP32 export with dynamically quantized weights.
+  onnx_path = os.path.splitext(path)[0] + '.onnx'
+  if not os.path.exists(onnx_path) or os.path.getmtime(onnx_path) < os.path.getmtime(path):
+    from ultralytics import YOLO
+    exported = YOLO(path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    if os.path.abspath(exported) != os.path.abspath(onnx_path):
+      os.replace(exported, onnx_path)
+  if not quantize:
+    return onnx_path
+
+  int8_path = os.path.splitext(path)[0] + '-int8.onnx'
+  if not os.path.exists(int8_path) or os.path.getmtime(int8_path) < os.path.getmtime(onnx_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+  return int8_path
+
+class OnnxModel():
+
+  # Runs an ultralytics YOLO detection export with ONNX Runtime on the CPU. predict takes the
+  # same arguments as YOLO.predict and returns Detections, which Vision.Result and its
+  # BoundingBoxes read the same way as ultralytics Results.
+
+  def __init__(self, path, threads=None, imgsz=640):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+      options.intra_op_num_threads = threads
+    self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+    self.input_name = self.session.get_inputs()[0].name
+
+    # ultralytics writes the class names and input size into the model metadata
+    metadata = self.session.get_modelmeta().custom_metadata_map
+    self.names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+    self.imgsz = ast.literal_eval(metadata['imgsz'])[0] if 'imgsz' in metadata else imgsz
+
+  def predict(self, source, conf=0.25, iou=0.7, agnostic_nms=False, batch=1, max_det=300, verbose=False, **kwargs):
+    sources = source if isinstance(source, list) else [source]
+    images = [self.load(source) for source in sources]
+    batch = max(batch, 1)
+
+    results = []
+    for start in range(0, len(images), batch):
+      chunk = images[start:start+batch]
+      inputs, transforms = zip(*[self.letterbox(image) for image in chunk])
+      outputs = self.session.run(None, {self.input_name: np.stack(inputs)})[0]
+      for i, (image, (gain, pad), output) in enumerate(zip(chunk, transforms, outputs)):
+        boxes = self.postprocess(output, gain, pad, image.shape, conf, iou, agnostic_nms, max_det)
+        results.append(Detections(image, self.names, boxes))
+    return results
+
+  def load(self, source):
+    if isinstance(source, str):
+      import cv2
+      image = cv2.imread(source)
+      if image is None:
+        raise FileNotFoundError(source)
+      return image
+    return np.asarray(source)
+
+  def letterbox(self, image):
+    # Scales the BGR image to fit the square input and pads it centered with gray, as ultralytics does.
+    # Returns the RGB CHW input in [0, 1] and the scale and padding to map boxes back.
+    import cv2
+    height, width = image.shape[:2]
+    gain = min(self.imgsz / height, self.imgsz / width)
+    resized_width, resized_height = round(width * gain), round(height * gain)
+    if (resized_width, resized_height) != (width, height):
+      image = cv2.resize(image, (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (self.imgsz - resized_width) / 2, (self.imgsz - resized_height) / 2
+    left, top = round(pad_x - 0.1), round(pad_y - 0.1)
+    padded = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+    padded[top:top+resized_height, left:left+resized_width] = image
+    return np.ascontiguousarray(padded[:, :, ::-1].transpose(2, 0, 1), dtype=np.float32) / 255, (gain, (left, top))
+
+  def postprocess(self, output, gain, pad, shape, conf, iou, agnostic_nms, max_det):
+    # output is (4 + classes, anchors) with center boxes and class scores.
+    # Returns the kept detections as rows of x1, y1, x2, y2, confidence, class.
+    output = output.T
+    scores = output[:, 4:]
+    classes = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(scores)), classes]
+    keep = confidences > conf
+    output, classes, confidences = output[keep], classes[keep], confidences[keep]
+
+    boxes = np.empty((len(output), 4), dtype=np.float32)
+    boxes[:, :2] = output[:, :2] - output[:, 2:4] / 2
+    boxes[:, 2:] = output[:, :2] + output[:, 2:4] / 2
+
+    # Shifting each class far apart keeps NMS within classes
+    offsets = 0 if agnostic_nms else classes[:, None] * 7680.0
+    keep = non_max_suppression(boxes + offsets, confidences, iou)[:max_det]
+    boxes, classes, confidences = boxes[keep], classes[keep], confidences[keep]
+
+    boxes -= [pad[0], pad[1], pad[0], pad[1]]
+    boxes /= gain
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+    return np.column_stack([boxes, confidences, classes]).astype(np.float32)
+
+class Detections():
+
+  # The parts of an ultralytics Results that Vision.Result reads, kept in NumPy so the ONNX
+  # backend, sliced prediction and streaming run without ultralytics and torch
+
+  def __init__(self, orig_img, names, boxes):
+    self.orig_img = orig_img
+    self.names = names
+    self.boxes = self.Boxes(boxes)
+
+  class Boxes():
+
+    # (n, 6) rows of x1, y1, x2, y2, confidence, class. Iterating yields one single-row Boxes per
+    # detection, as ultralytics does.
+
+    def __init__(self, data):
+      self.data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+
+    def __len__(self):
+      return len(self.data)
+
+    def __iter__(self):
+      for i in range(len(self.data)):
+        yield type(self)(self.data[i:i+1])
+
+    @property
+    def xyxy(self):
+      return self.data[:, :4]
+
+    @property
+    def xywh(self):
+      xyxy = self.data[:, :4]
+      return np.column_stack([(xyxy[:, :2] + xyxy[:, 2:]) / 2, xyxy[:, 2:] - xyxy[:, :2]])
+
+    @property
+    def conf(self):
+      return self.data[:, 4]
+
+    @property
+    def cls(self):
+      return self.data[:, 5]
+
+def box_iou(boxes, others):
+  # IoU of every box with every other box, both as x1, y1, x2, y2 rows
+  width = np.minimum(boxes[:, None, 2], others[None, :, 2]) - np.maximum(boxes[:, None, 0], others[None, :, 0])
+  height = np.minimum(boxes[:, None, 3], others[None, :, 3]) - np.maximum(boxes[:, None, 1], others[None, :, 1])
+  overlap = np.clip(width, 0, None) * np.clip(height, 0, None)
+  areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+  other_areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+  return overlap / (areas[:, None] + other_areas[None, :] - overlap + 1e-9)
+
+def slice_windows(height, width, size, overlap=0.2):
+  # Top left corners of square slices that cover the image and overlap by the given share,
+  # the last slice of every row and column is aligned with the image border
+  def starts(length):
+    if length <= size:
+      return [0]
+    step = max(int(size * (1 - overlap)), 1)
+    positions = list(range(0, length - size, step))
+    return positions + [length - size]
+  return [(x, y) for y in starts(height) for x in starts(width)]
+
+def merge_detections(detections, threshold=0.5):
+  # Greedy non-maximum merging of x1, y1, x2, y2, confidence, class rows across slices. Boxes that
+  # cover more than threshold of the smaller one are the same tile: the most confident keeps its
+  # class and grows to the union, so a tile cut by a slice border ends up whole.
+  # Candidate pairs come from a sweep over the boxes sorted by x1, so only boxes that overlap in x
+  # are compared.
+  boxes = detections[:, :4]
+  n = len(boxes)
+  by_x = np.argsort(boxes[:, 0], kind='stable')
+  starts = np.arange(1, n + 1)
+  counts = np.maximum(np.searchsorted(boxes[by_x, 0], boxes[by_x, 2], side='left') - starts, 0)
+  offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+  first, second = by_x[np.repeat(np.arange(n), counts)], by_x[np.repeat(starts, counts) + offsets]
+
+  areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+  width = np.minimum(boxes[first, 2], boxes[second, 2]) - np.maximum(boxes[first, 0], boxes[second, 0])
+  height = np.minimum(boxes[first, 3], boxes[second, 3]) - np.maximum(boxes[first, 1], boxes[second, 1])
+  overlap = np.clip(width, 0, None) * np.clip(height, 0, None)
+  same = overlap / (np.minimum(areas[first], areas[second]) + 1e-9) > threshold
+
+  neighbours = [[] for _ in range(n)]
+  for i, j in zip(first[same].tolist(), second[same].tolist()):
+    neighbours[i].append(j)
+    neighbours[j].append(i)
+
+  merged = []
+  used = np.zeros(n, dtype=bool)
+  for i in np.argsort(-detections[:, 4], kind='stable').tolist():
+    if used[i]:
+      continue
+    group = [i] + [j for j in neighbours[i] if not used[j]]
+    used[group] = True
+    merged.append([*boxes[group, :2].min(axis=0), *boxes[group, 2:].max(axis=0), detections[i, 4], detections[i, 5]])
+  return np.array(merged, dtype=float).reshape(-1, 6)
+
+def non_max_suppression(boxes, scores, iou):
+  # Greedy NMS on x1, y1, x2, y2 boxes, returns the kept indices by descending score
+  order = np.argsort(-scores, kind='stable')
+  areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+  keep = []
+  while len(order):
+    i, order = order[0], order[1:]
+    keep.append(i)
+    width = np.minimum(boxes[i, 2], boxes[order, 2]) - np.maximum(boxes[i, 0], boxes[order, 0])
+    height = np.minimum(boxes[i, 3], boxes[order, 3]) - np.maximum(boxes[i, 1], boxes[order, 1])
+    overlap = np.clip(width, 0, None) * np.clip(height, 0, None)
+    order = order[overlap / (areas[i] + areas[order] - overlap + 1e-9) <= iou]
+  return np.array(keep, dtype=int)
 
 class Vision():
 
-  def __init__(self):
-    self.model = YOLO(os.path.join(os.path.dirname(__file__), 'model/rummikub.pt'))
+  # backend 'torch' runs the weights through ultralytics, 'onnx' exports them once and runs them
+  # with ONNX Runtime, optionally INT8 quantized and with a fixed number of intra-op threads
+
+  def __init__(self, model_path=MODEL_PATH, backend='torch', quantize=False, threads=None):
+    self.model_path = model_path
+    self.backend = backend
+    self.quantize = quantize
+    self.threads = threads
+    self.result = None
+    self.results = []
 
-  def predict(self, img_path, conf=0.5, iou=0.25):
-    results = self.model.predict(
-      source = img_path,
-      conf = conf,
-      iou = iou,
-      agnostic_nms = True,
-      verbose = False,
-    )
-    self.result = self.Result(results[0])
-    return self.result
+  @property
+  def model(self):
+    return load_model(self.model_path, self.backend, self.quantize, self.threads)
+
+  def warmup(self, imgsz=640):
+    # Loads the model and runs it once on a blank image so the first real request does not
+    # pay for weight loading, layer fusing and backend initialization
+    with PROFILER.stage('vision.warmup'):
+      self.model.predict(source=np.zeros((imgsz, imgsz, 3), dtype=np.uint8), verbose=False)
+    return self
+
+  def predict(self, img_path, conf=0.5, iou=0.25, slice_size=None, overlap=0.2, workers=None):
+    # img_path is an image path or array, or a list of them that YOLO runs as one batch.
+    # Returns a Result, or a list with one Result per image for a list.
+    # With slice_size, every image is cut into overlapping square slices that are detected at full
+    # resolution and merged into one result (predict_sliced).
+    batched = isinstance(img_path, (list, tuple))
+    sources = list(img_path) if batched else [img_path]
+    if slice_size:
+      results = [self.predict_sliced(source, conf, iou, slice_size, overlap, workers) for source in sources]
+    else:
+      with PROFILER.stage('vision.predict', images=len(sources)):
+        results = self.model.predict(
+          source = sources if batched else img_path,
+          conf = conf,
+          iou = iou,
+          agnostic_nms = True,
+          batch = len(sources),
+          verbose = False,
+        )
+    self.results = [self.Result(result) for result in results]
+    self.result = self.results[-1]
+    return self.results if batched else self.result
+
+  def predict_sliced(self, source, conf=0.5, iou=0.25, slice_size=640, overlap=0.2, workers=None):
+    # Runs the slices as one batch, or split over a thread pool of workers for the ONNX backend.
+    # ultralytics predictors are not thread-safe, so the PyTorch backend always batches.
+    # Tiles cut by a slice border are detected in part in one slice and whole in the next;
+    # merge_detections joins them and removes duplicates from the overlaps.
+    image = source
+    if isinstance(source, str):
+      import cv2
+      image = cv2.imread(source)
+      if image is None:
+        raise FileNotFoundError(source)
+
+    windows = slice_windows(image.shape[0], image.shape[1], slice_size, overlap)
+    crops = [image[y:y+slice_size, x:x+slice_size] for x, y in windows]
+
+    def detect(crops):
+      return self.model.predict(source=crops, conf=conf, iou=iou, agnostic_nms=True, batch=len(crops), verbose=False)
+
+    with PROFILER.stage('vision.predict', images=len(crops)):
+      if workers and workers > 1 and self.backend != 'torch':
+        from concurrent.futures import ThreadPoolExecutor
+        chunks = [crops[i::workers] for i in range(workers) if crops[i::workers]]
+        with ThreadPoolExecutor(len(chunks)) as executor:
+          chunk_results = list(executor.map(detect, chunks))
+        results = [None] * len(crops)
+        for i, chunk in enumerate(chunk_results):
+          results[i::workers] = chunk
+      else:
+        results = detect(crops)
+
+    with PROFILER.stage('vision.merge_slices') as stage:
+      detections = [np.column_stack([np.array(result.boxes.xyxy.tolist()).reshape(-1, 4) + [x, y, x, y],
+        result.boxes.conf.tolist(), result.boxes.cls.tolist()]) for (x, y), result in zip(windows, results)]
+      detections = np.concatenate(detections) if detections else np.empty((0, 6))
+      merged = merge_detections(detections)
+      stage.set(slices=len(crops), detections=len(detections), merged=len(merged))
+
+    return Detections(image, results[0].names, merged)
+
+  def stream(self, source=0, conf=0.5, iou=0.25, level='box_set', change_threshold=0.002, pixel_threshold=25,
+      min_hits=2, max_misses=2):
+    # Yields (frame index, Result) from a camera index, video file or iterable of BGR frames whenever
+    # the tracked tiles settle on a new state: the tiles at the 'box' level, their sets at 'box_set'.
+    # change_threshold is the share of pixels that has to change, a single tile is a fraction of a percent.
+    # A frame only goes through the model once the picture has stopped moving and differs from the
+    # last frame that did, or while the tracker still has tiles to confirm or drop.
+    tracker = self.Tracker(min_hits=min_hits, max_misses=max_misses)
+    previous = reference = None
+    state = None
+
+    for index, frame in enumerate(self.frames(source)):
+
+      with PROFILER.stage('vision.frame_diff'):
+        thumbnail = self.thumbnail(frame)
+        moving = previous is not None and self.changed(thumbnail, previous, change_threshold, pixel_threshold)
+        previous = thumbnail
+        if moving or (reference is not None and tracker.settled and
+            not self.changed(thumbnail, reference, change_threshold, pixel_threshold)):
+          continue
+      reference = thumbnail
+
+      with PROFILER.stage('vision.predict', images=1):
+        result = self.model.predict(source=frame, conf=conf, iou=iou, agnostic_nms=True, verbose=False)[0]
+      boxes = result.boxes
+      tracker.update(np.array(boxes.xyxy.tolist()).reshape(-1, 4), [int(c) for c in boxes.cls.tolist()], boxes.conf.tolist())
+
+      self.result = self.Result(Detections(frame, result.names, tracker.boxes()))
+      match level:
+        case 'box':
+          current = tuple(sorted(box.cls[1] for box in self.result.boxes))
+        case 'box_set':
+          current = tuple(sorted(tuple(sorted(box.cls[1] for box in box_set)) for box_set in self.result.box_sets))
+      if tracker.settled and current != state:
+        state = current
+        yield index, self.result
+
+  @staticmethod
+  def frames(source):
+    if not isinstance(source, (int, str)):
+      yield from source
+      return
+    import cv2
+    capture = cv2.VideoCapture(source)
+    try:
+      while True:
+        read, frame = capture.read()
+        if not read:
+          break
+        yield frame
+    finally:
+      capture.release()
+
+  @staticmethod
+  def thumbnail(frame, width=160):
+    import cv2
+    height = max(int(frame.shape[0] * width / frame.shape[1]), 1)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return cv2.GaussianBlur(cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA), (5, 5), 0)
+
+  @staticmethod
+  def changed(thumbnail, other, change_threshold=0.002, pixel_threshold=25):
+    # Share of thumbnail pixels whose brightness moved by more than pixel_threshold
+    difference = np.abs(thumbnail.astype(np.int16) - other.astype(np.int16))
+    return np.count_nonzero(difference > pixel_threshold) > change_threshold * difference.size
+
+  class Tracker():
+
+    # Matches detections to tiles seen in earlier frames by IoU. A tile counts once it was
+    # detected min_hits times and is dropped after max_misses inferences without it, so single
+    # missed or spurious detections do not change the state. Its class is the majority vote.
+
+    def __init__(self, min_hits=2, max_misses=2, iou=0.3):
+      self.min_hits = min_hits
+      self.max_misses = max_misses
+      self.iou = iou
+      self.tracks = []
+
+    @property
+    def settled(self):
+      return all(track.hits >= self.min_hits and track.misses == 0 for track in self.tracks)
+
+    def update(self, boxes, classes, confidences):
+      # Greedy matching, highest overlap first
+      matched_tracks, matched = set(), set()
+      if self.tracks and len(boxes):
+        overlaps = box_iou(np.array([track.box for track in self.tracks]), boxes)
+        for t, d in zip(*np.unravel_index(np.argsort(-overlaps, axis=None), overlaps.shape)):
+          if overlaps[t, d] < self.iou:
+            break
+          if t in matched_tracks or d in matched:
+            continue
+          self.tracks[t].update(boxes[d], classes[d], confidences[d])
+          matched_tracks.add(t)
+          matched.add(d)
+
+      for t, track in enumerate(self.tracks):
+        track.misses = 0 if t in matched_tracks else track.misses + 1
+      self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+      for d in range(len(boxes)):
+        if d not in matched:
+          self.tracks.append(self.Track(boxes[d], classes[d], confidences[d]))
+
+    def boxes(self):
+      # Confirmed tiles as rows of x1, y1, x2, y2, confidence, class
+      confirmed = [track for track in self.tracks if track.hits >= self.min_hits]
+      return np.array([[*track.box, track.confidence, track.cls] for track in confirmed], dtype=np.float32).reshape(-1, 6)
+
+    class Track():
+
+      __slots__ = ('box', 'votes', 'confidence', 'hits', 'misses')
+
+      def __init__(self, box, cls, confidence):
+        self.box = box
+        self.votes = {cls: 1}
+        self.confidence = confidence
+        self.hits = 1
+        self.misses = 0
+
+      @property
+      def cls(self):
+        return max(self.votes, key=self.votes.get)
+
+      def update(self, box, cls, confidence):
+        self.box = box
+        self.votes[cls] = self.votes.get(cls, 0) + 1
+        self.confidence = confidence
+        self.hits += 1
 
   class Result():
 
@@ -24,44 +465,48 @@ class Vision():
       self.img_orig = result.orig_img.copy()
       self.img = result.orig_img.copy()
       self.names = result.names
-      self.boxes = [self.BoundingBox(box, self) for box in result.boxes]
-      self.box_sets = self.getBoxSets()
+      with PROFILER.stage('vision.boxes') as stage:
+        self.boxes = [self.BoundingBox(box, self) for box in result.boxes]
+        stage.set(boxes=len(self.boxes))
+      with PROFILER.stage('vision.box_sets') as stage:
+        self.box_sets = self.getBoxSets()
+        stage.set(box_sets=len(self.box_sets))
 
     def getBoxSets(self, margin=5):
-
+      # Boxes whose margin-expanded rectangles overlap belong to the same set. All pairs are tested at
+      # once on the box arrays and the sets are the connected components, joined with union-find.
+      # Sets keep the order of their first box and list their boxes from left to right.
       boxes = self.boxes
-      used = []
-      box_sets = []
-
-      for box in boxes:
+      if not boxes:
+        return []
 
-        if not box in used:
+      xyxy = np.array([box.xyxy for box in boxes])
+      portrait = np.array([box.orientation == 'portrait' for box in boxes])
+      expanded = xyxy + np.where(portrait[:, None], [-margin, 0, margin, 0], [0, -margin, 0, margin])
 
-          existing_set = False
-          neighbours = box.findNeighbours(boxes, margin=margin)
-          box_set = neighbours.copy()
+      overlap_x = np.maximum(expanded[:, None, 0], xyxy[None, :, 0]) < np.minimum(expanded[:, None, 2], xyxy[None, :, 2])
+      overlap_y = np.maximum(expanded[:, None, 1], xyxy[None, :, 1]) < np.minimum(expanded[:, None, 3], xyxy[None, :, 3])
+      overlap = overlap_x & overlap_y
+      first, second = np.nonzero(np.triu(overlap | overlap.T, 1))
 
-          if any([box in used for box in neighbours]):
-            for _box_set in box_sets:
-              if any([box in _box_set for box in neighbours]):
-                existing_set = True
-                box_set = _box_set
+      parent = list(range(len(boxes)))
 
-          if not existing_set:
-            box_set.append(box)
-            box_sets.append(box_set)
-            used.extend(box_set)
+      def find(i):
+        while parent[i] != i:
+          parent[i] = parent[parent[i]]
+          i = parent[i]
+        return i
 
-          else:
-            new_boxes = [box for box in neighbours + [box] if box not in box_set]
-            box_set.extend(new_boxes)
-            used.extend(new_boxes)
-
-        else:
-          continue
+      for i, j in zip(first.tolist(), second.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+          parent[max(root_i, root_j)] = min(root_i, root_j)
 
-      return box_sets
+      box_sets = {}
+      for i in np.lexsort((xyxy[:, 1], xyxy[:, 0])).tolist():
+        box_sets.setdefault(find(i), []).append(boxes[i])
 
+      return [box_sets[root] for root in sorted(box_sets)]
 
     def resetImg(self):
       self.img = self.img_orig.copy()
@@ -77,6 +522,7 @@ class Vision():
             y1 = [box.xyxyWithMargin(margin=margin)[1] for box in box_set]
             x2 = [box.xyxyWithMargin(margin=margin)[2] for box in box_set]
             y2 = [box.xyxyWithMargin(margin=margin)[3] for box in box_set]
+            import cv2
             cv2.rectangle(self.img, (min(x1), min(y1)), (max(x2), max(y2)), color, thickness)
 
     def drawMarkers(self, color=(0, 255, 0), thickness=1):
@@ -134,12 +580,15 @@ class Vision():
         x1, y1, x2, y2 = self.xyxyWithMargin(margin=margin)
         start_point = (x1, y1)
         end_point = (x2, y2)
+        import cv2
         cv2.rectangle(self.result.img, start_point, end_point, color, thickness)
 
       def drawMarker(self, color=(0, 255, 0), thickness=1):
+        import cv2
         cv2.drawMarker(self.result.img, (self.center_x, self.center_y), color, cv2.MARKER_CROSS)
 
       def drawLabel(self):
         color, *value = self.cls[1].upper().split('_', 1)
         label = color[0] + color[-1] + (value[0].zfill(2) if value else '')
+        import cv2
         cv2.putText(self.result.img, label, (self.x+10, int(self.y+self.height*0.8)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0,0,0), 2)
\ No newline at end of file